@@ -0,0 +1,75 @@
+"""Startup budget: measures the import time of the FastAPI app with `python -X importtime` and checks that the heavy
+ML dependencies are deferred until the classifier is loaded.
+
+    python -m benchmarks.check_import_time --budget-ms 1000
+
+Exits with a non-zero status when the import takes longer than `--budget-ms`, or imports one of `--forbidden`.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# loaded with the classifier, by the gunicorn master or on first use, never by importing the app
+FORBIDDEN_MODULES = ("torch", "transformers", "onnxruntime", "scipy", "sklearn", "mlflow", "langchain", "openai",
+                     "requests")
+
+
+def parse_import_times(importtime_output):
+    """Returns {module: (self_us, cumulative_us)} from the stderr of `python -X importtime`."""
+    import_times = {}
+
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        import_times[module.strip()] = (int(self_us), int(cumulative_us))
+
+    return import_times
+
+
+def measure_import_times(module):
+    # a fresh interpreter, with the bytecode cache of the previous runs
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True,
+                            text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if result.returncode != 0:
+        sys.exit(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    return parse_import_times(result.stderr)
+
+
+def main(args):
+    # the first run also compiles the bytecode, the fastest run is the one least disturbed by the machine
+    runs = [measure_import_times(args.module) for _ in range(args.runs)]
+    import_times = min(runs, key=lambda run: run[args.module][1])
+    import_ms = import_times[args.module][1] / 1000
+
+    print(f"import {args.module}: {import_ms:.0f}ms (budget: {args.budget_ms:.0f}ms), "
+          f"{len(import_times)} modules, heaviest:")
+    for module, (_, cumulative_us) in sorted(import_times.items(), key=lambda item: item[1][1],
+                                             reverse=True)[1:args.top + 1]:
+        print(f"  {cumulative_us / 1000:8.1f}ms  {module}")
+
+    errors = []
+    if import_ms > args.budget_ms:
+        errors.append(f"import {args.module} took {import_ms:.0f}ms, over the {args.budget_ms:.0f}ms budget")
+
+    forbidden_modules = sorted(module for module in import_times if module.split(".")[0] in args.forbidden)
+    if forbidden_modules:
+        errors.append(f"import {args.module} loads {', '.join(forbidden_modules[:10])}")
+
+    if errors:
+        sys.exit("\n".join(errors))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="entrypoint", help="module whose import is measured")
+    parser.add_argument("--budget-ms", type=float, default=1000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15, help="heaviest imports listed")
+    parser.add_argument("--forbidden", type=lambda value: tuple(value.split(",")), default=FORBIDDEN_MODULES,
+                        help="comma-separated top-level packages which must not be imported")
+
+    main(parser.parse_args())
@@ -0,0 +1,126 @@
+"""Round-trip check of the binary formats the FAQ is stored in: the packed BYTEA embeddings
+(components/qa_system/embedding_codec.py) and the memory-mapped FAQ snapshot (components/qa_system/faq_snapshot.py).
+
+    python -m benchmarks.check_storage_formats
+
+Exits with a non-zero status, listing the failures, when a format does not decode to what was encoded.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from components.exceptions.custom_exceptions import EmbeddingError
+from components.qa_system.embedding_codec import FORMAT_CODES, encode_embedding, decode_embedding
+from components.qa_system.faq_index import normalize_embeddings
+from components.qa_system.faq_snapshot import open_snapshot, read_snapshot_version, write_snapshot
+
+# the largest error each format may introduce on a component, relative to the largest component of the vector
+MAX_RELATIVE_ERRORS = {"float32": 0.0, "float16": 1e-3, "int8": 0.5 / 127}
+
+
+def check_embedding_codec(embeddings):
+    errors = []
+
+    for storage_format in FORMAT_CODES:
+        for embedding in embeddings:
+            packed = encode_embedding(embedding, storage_format)
+            # psycopg2 returns BYTEA columns as memoryviews
+            decoded = decode_embedding(memoryview(packed))
+
+            if decoded.dtype != np.float32 or decoded.shape != embedding.shape:
+                errors.append(f"{storage_format}: decoded {decoded.dtype}{decoded.shape}, "
+                              f"expected float32{embedding.shape}")
+                continue
+
+            max_abs = float(np.max(np.abs(embedding))) if embedding.size else 0.0
+            error = float(np.max(np.abs(decoded - embedding))) if embedding.size else 0.0
+            if error > MAX_RELATIVE_ERRORS[storage_format] * max_abs + 1e-7:
+                errors.append(f"{storage_format}: error {error:.2e} on a {embedding.size}-dimension embedding")
+
+    if decode_embedding(None) is not None:
+        errors.append("None is not decoded to None")
+
+    for invalid_data, description in ((b"\x01", "a truncated header"), (b"\x09\x00\x00\x00", "an unknown format")):
+        try:
+            decode_embedding(invalid_data)
+            errors.append(f"{description} is decoded without error")
+        except EmbeddingError:
+            pass
+
+    return errors
+
+
+def check_faq_snapshot(embeddings, directory):
+    errors = []
+    path = os.path.join(directory, "faq_index.snapshot")
+    rows, dimension = embeddings.shape
+    provider_name = "local:/models/é中"
+    questions = [f"Question {index} é中?" for index in range(rows)]
+    answers = [f"Answer {index}" * (index % 3) for index in range(rows)]
+    question_matrix = normalize_embeddings(embeddings)
+    answer_matrix = normalize_embeddings(embeddings[::-1])
+
+    if read_snapshot_version(path) is not None:
+        errors.append("a missing snapshot has a version")
+
+    for version, written_answer_matrix in ((1, None), (2, answer_matrix)):
+        write_snapshot(path, version, provider_name, dimension, questions, answers, question_matrix,
+                       written_answer_matrix)
+        (mapped_version, mapped_provider_name, mapped_dimension, mapped_questions, mapped_answers,
+         mapped_question_matrix, mapped_answer_matrix) = open_snapshot(path)
+
+        if read_snapshot_version(path) != version or mapped_version != version:
+            errors.append(f"snapshot version {mapped_version}, expected {version}")
+        if mapped_provider_name != provider_name or mapped_dimension != dimension:
+            errors.append(f"snapshot version {version}: provider {mapped_provider_name} ({mapped_dimension} "
+                          f"dimensions), expected {provider_name} ({dimension} dimensions)")
+        if list(mapped_questions) != questions or list(mapped_answers) != answers:
+            errors.append(f"snapshot version {version}: the questions or answers differ")
+        if not np.array_equal(mapped_question_matrix, question_matrix):
+            errors.append(f"snapshot version {version}: the question matrix differs")
+
+        if written_answer_matrix is None:
+            if mapped_answer_matrix is not None:
+                errors.append(f"snapshot version {version}: an answer matrix is mapped, none was written")
+        elif mapped_answer_matrix is None or not np.allclose(mapped_answer_matrix, written_answer_matrix,
+                                                             atol=1e-3):
+            errors.append(f"snapshot version {version}: the answer matrix differs")
+
+    write_snapshot(path, 3, provider_name, dimension, [], [], np.empty((0, 0), dtype=np.float32))
+    empty_version, _, empty_dimension, empty_questions, empty_answers, empty_question_matrix, _ = open_snapshot(path)
+    if empty_version != 3 or empty_dimension != dimension or len(empty_questions) or len(empty_answers) \
+            or empty_question_matrix.size:
+        errors.append("the empty snapshot is not empty")
+
+    return errors
+
+
+def main(args):
+    random = np.random.default_rng(args.seed)
+    embeddings = random.standard_normal((args.rows, args.dimension)).astype(np.float32)
+    # edge cases: a zero vector and a single dominant component
+    embeddings[0] = 0.0
+    embeddings[1] = 0.0
+    embeddings[1, 0] = -3.0
+
+    errors = check_embedding_codec(list(embeddings) + [np.empty(0, dtype=np.float32)])
+    with tempfile.TemporaryDirectory() as directory:
+        errors += check_faq_snapshot(embeddings, directory)
+
+    if errors:
+        sys.exit("\n".join(errors))
+
+    print(f"embedding formats {', '.join(FORMAT_CODES)} and FAQ snapshot: round-trips OK "
+          f"({args.rows} x {args.dimension})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--seed", type=int, default=0)
+
+    main(parser.parse_args())
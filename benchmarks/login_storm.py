@@ -0,0 +1,99 @@
+"""Load test: /questions/ask-question latency with and without a concurrent burst of /auth/token logins.
+
+Runs against a live server, e.g.:
+
+    python benchmarks/login_storm.py --base-url http://localhost:8000 --logins 50 --duration 20
+
+Exits with a non-zero status when the p95 latency during the login storm is more than `--max-slowdown` times the
+baseline p95.
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+import httpx
+
+
+def percentile(samples, percent):
+    if not samples:
+        return float("nan")
+    return statistics.quantiles(samples, n=100, method="inclusive")[percent - 1] if len(samples) > 1 else samples[0]
+
+
+def summarize(samples):
+    return {
+        "requests": len(samples),
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000
+    }
+
+
+async def get_access_token(client, username, password):
+    await client.post("/auth/register", json={"username": username, "password": password})
+    response = await client.post("/auth/token", data={"username": username, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def sample_question_latency(client, access_token, question, duration, interval):
+    samples = []
+    deadline = time.perf_counter() + duration
+
+    while time.perf_counter() < deadline:
+        started_at = time.perf_counter()
+        response = await client.post("/questions/ask-question", json={"user_question": question},
+                                     headers={"Authorization": f"Bearer {access_token}"})
+        response.raise_for_status()
+        samples.append(time.perf_counter() - started_at)
+        await asyncio.sleep(interval)
+
+    return samples
+
+
+async def login_storm(client, username, password, concurrency, duration):
+    deadline = time.perf_counter() + duration
+    logins = {"ok": 0, "rejected": 0}
+
+    async def login_loop():
+        while time.perf_counter() < deadline:
+            response = await client.post("/auth/token", data={"username": username, "password": password})
+            logins["ok" if response.status_code == 200 else "rejected"] += 1
+
+    await asyncio.gather(*(login_loop() for _ in range(concurrency)))
+    return logins
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.logins + 10)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60, limits=limits) as client:
+        access_token = await get_access_token(client, args.username, args.password)
+
+        baseline = await sample_question_latency(client, access_token, args.question, args.duration, args.interval)
+
+        storm_samples, logins = await asyncio.gather(
+            sample_question_latency(client, access_token, args.question, args.duration, args.interval),
+            login_storm(client, args.username, args.password, args.logins, args.duration))
+
+    baseline_summary, storm_summary = summarize(baseline), summarize(storm_samples)
+    print(f"baseline:    {baseline_summary}")
+    print(f"login storm: {storm_summary}, logins: {logins}")
+
+    slowdown = storm_summary["p95_ms"] / baseline_summary["p95_ms"]
+    print(f"p95 slowdown during the login storm: {slowdown:.2f}x (max {args.max_slowdown}x)")
+    return 0 if slowdown <= args.max_slowdown else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", default="login_storm_user")
+    parser.add_argument("--password", default="login_storm_password")
+    parser.add_argument("--question", default="How do I deactivate my account?")
+    parser.add_argument("--logins", type=int, default=50, help="concurrent login loops during the storm")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per phase")
+    parser.add_argument("--interval", type=float, default=0.05, help="pause between two sampled questions")
+    parser.add_argument("--max-slowdown", type=float, default=1.5)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,341 @@
+"""Benchmarks of the QA pipeline, reporting p50/p95/p99 latency and requests/sec per scenario.
+
+Scenarios:
+- `similarity_search`: FAQIndex.search / search_batch on synthetic FAQs of `--faq-sizes` entries (in memory).
+- `classifier`: the micro-batched classifier under `--concurrency` concurrent callers, with `StubClassifier` or,
+  with `--classifier-model`, a real model directory / Hugging Face repository.
+- `pipeline`: process_user_query end to end, OpenAI being served in-process by the stub of `benchmarks.stubs`.
+- `database`: loads synthetic FAQs into the `embeddings` table and times FAQIndex.reload (retrieval + build) and,
+  with EMBEDDINGS_BACKEND=pgvector, the SQL search. Writes to the configured database, use a throwaway one.
+- `local_embedding`: query embedding latency of the local embedding provider (`--local-embedding-model`, downloaded
+  from Hugging Face unless a directory), one question at a time and under `--concurrency` concurrent callers.
+- `endpoint`: /questions/ask-question of a live server (`--base-url`), ideally started with OPENAI_API_BASE_URL
+  pointing to `python -m benchmarks.stubs`.
+
+Run from the repository root, the results are written as JSON to compare them across commits:
+
+    python -m benchmarks.run_benchmarks --scenarios similarity_search,classifier,pipeline --output bench.json
+    python -m benchmarks.run_benchmarks --scenarios similarity_search --compare bench.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import httpx
+import numpy as np
+
+from benchmarks.stubs import StubClassifier, create_openai_stub_app, stub_embedding
+from benchmarks.synthetic_faq import generate_faq
+
+ALL_SCENARIOS = ("similarity_search", "classifier", "pipeline", "database", "local_embedding", "endpoint")
+
+
+def summarize(samples, wall_seconds):
+    samples_ms = sorted(sample * 1000 for sample in samples)
+    return {
+        "requests": len(samples_ms),
+        "mean_ms": statistics.fmean(samples_ms),
+        "p50_ms": float(np.percentile(samples_ms, 50)),
+        "p95_ms": float(np.percentile(samples_ms, 95)),
+        "p99_ms": float(np.percentile(samples_ms, 99)),
+        "requests_per_second": len(samples_ms) / wall_seconds if wall_seconds else float("inf")
+    }
+
+
+def run_sequentially(operation, requests):
+    samples = []
+    started_at = time.perf_counter()
+
+    for index in range(requests):
+        operation_started_at = time.perf_counter()
+        operation(index)
+        samples.append(time.perf_counter() - operation_started_at)
+
+    return summarize(samples, time.perf_counter() - started_at)
+
+
+async def run_concurrently(operation, requests, concurrency):
+    samples = []
+    indices = iter(range(requests))
+    started_at = time.perf_counter()
+
+    async def worker():
+        for index in indices:
+            operation_started_at = time.perf_counter()
+            await operation(index)
+            samples.append(time.perf_counter() - operation_started_at)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(samples, time.perf_counter() - started_at)
+
+
+def bench_similarity_search(args):
+    import components.config.constants as constants
+    from components.qa_system.faq_index import FAQIndex
+
+    results = {}
+    rng = np.random.default_rng(1)
+
+    for faq_size in args.faq_sizes:
+        questions, answers, question_embeddings = generate_faq(faq_size, args.dimension)
+        index = FAQIndex()
+        index.load(questions, answers, question_embeddings)
+
+        queries = rng.standard_normal((args.requests, args.dimension), dtype=np.float32)
+        results[f"similarity_search/faq={faq_size}"] = run_sequentially(
+            lambda query_index: index.search(queries[query_index], k=1), args.requests)
+
+        batch_queries = queries[:32]
+        batch_result = run_sequentially(lambda _: index.search_batch(batch_queries, k=1), max(1, args.requests // 32))
+        batch_result["queries_per_second"] = batch_result["requests_per_second"] * len(batch_queries)
+        results[f"similarity_search_batch32/faq={faq_size}"] = batch_result
+
+        # two-stage retrieval: the answer embeddings of the candidates only are read, whatever the FAQ size
+        rerank_index = FAQIndex(answer_weight=0.3)
+        rerank_index.load(questions, answers, question_embeddings,
+                          rng.standard_normal((faq_size, args.dimension), dtype=np.float32))
+        results[f"similarity_search_rerank/faq={faq_size}"] = run_sequentially(
+            lambda query_index: rerank_index.search(queries[query_index], k=constants.RETRIEVAL_TOP_K), args.requests)
+        del question_embeddings
+
+    return results
+
+
+async def bench_classifier(args):
+    from components.qa_system.batching import MicroBatcher
+    from components.qa_system.metrics import snapshot
+    from components.qa_system.model_registry import load_model_and_tokenizer, \
+        perform_batch_binary_text_classification
+
+    if args.classifier_model:
+        binary_classifier = load_model_and_tokenizer(args.classifier_model)
+    else:
+        binary_classifier = StubClassifier(args.classifier_batch_latency_ms, args.classifier_item_latency_ms)
+
+    results = {}
+    questions = [f"How do I reset the password of account {index}?" for index in range(args.requests)]
+
+    for max_batch_size in (1, args.classifier_max_batch_size):
+        batcher = MicroBatcher(f"benchmark_classifier_{max_batch_size}",
+                               lambda batch: perform_batch_binary_text_classification(batch, binary_classifier),
+                               max_batch_size=max_batch_size, max_wait_ms=args.classifier_max_wait_ms)
+        await batcher.start()
+
+        result = await run_concurrently(lambda index: batcher.submit(questions[index]), args.requests,
+                                        args.concurrency)
+        batch_size = snapshot(batcher.batch_size)
+        result["mean_batch_size"] = batch_size["sum"] / batch_size["count"] if batch_size["count"] else 0
+        results[f"classifier/max_batch_size={max_batch_size}"] = result
+
+        await batcher.stop()
+
+    return results
+
+
+async def bench_pipeline(args):
+    import components.config.constants as constants
+    import components.qa_system.faq_search as faq_search
+    from components.qa_system.answer_cache import answer_cache
+    from components.qa_system.embedding_cache import query_embedding_cache
+
+    stub_app = create_openai_stub_app(args.embedding_latency_ms, args.completion_latency_ms, args.dimension)
+    faq_search.openai_client.transport = httpx.ASGITransport(app=stub_app)
+    query_embedding_cache.shared_tier = False
+    constants.EMBEDDINGS_BACKEND = "numpy"
+
+    results = {}
+    for faq_size in args.faq_sizes:
+        questions, answers, _ = generate_faq(faq_size, dimension=1)
+        # the stub embeds deterministically, so asking a FAQ question verbatim is a local hit
+        faq_search.faq_index.load(questions, answers, [stub_embedding(question, args.dimension)
+                                                       for question in questions])
+        query_embedding_cache.memory_tier.clear()
+        answer_cache.clear()
+
+        # every other question is in the FAQ, the others are new and go to the (stub) chat completion
+        user_questions = [questions[index % faq_size] if index % 2 == 0 else f"What is the meaning of {index}?"
+                          for index in range(args.requests)]
+
+        results[f"pipeline/faq={faq_size}"] = await run_concurrently(
+            lambda index: faq_search.process_user_query(user_questions[index], constants.SIMILARITY_THRESHOLD),
+            args.requests, args.concurrency)
+        results[f"pipeline/faq={faq_size}"]["openai_requests"] = dict(stub_app.state.requests)
+        stub_app.state.requests.update(embeddings=0, completions=0)
+
+    await faq_search.openai_client.close()
+    return results
+
+
+def bench_database(args):
+    import components.config.constants as constants
+    from benchmarks.synthetic_faq import load_into_database, delete_from_database
+    from components.qa_system.faq_index import FAQIndex
+    from components.qa_system.pgvector_index import PgVectorIndex
+
+    results = {}
+    rng = np.random.default_rng(2)
+
+    try:
+        for faq_size in args.faq_sizes:
+            delete_from_database()
+            load_into_database(faq_size, args.dimension)
+
+            index = FAQIndex()
+            results[f"database_reload/faq={faq_size}"] = run_sequentially(lambda _: index.reload(),
+                                                                          args.database_reloads)
+
+            if constants.EMBEDDINGS_BACKEND == "pgvector":
+                queries = rng.standard_normal((args.requests, args.dimension), dtype=np.float32)
+                pgvector_index = PgVectorIndex()
+                results[f"pgvector_search/faq={faq_size}"] = run_sequentially(
+                    lambda query_index: pgvector_index.search(queries[query_index], k=1), args.requests)
+    finally:
+        delete_from_database()
+
+    return results
+
+
+async def bench_local_embedding(args):
+    import components.config.constants as constants
+    from components.qa_system.embedding_provider import LocalEmbeddingProvider
+
+    provider = LocalEmbeddingProvider(args.local_embedding_model, args.local_embedding_backend,
+                                      max_batch_size=constants.LOCAL_EMBEDDING_BATCH_SIZE,
+                                      max_wait_ms=constants.LOCAL_EMBEDDING_MAX_WAIT_MS)
+    await provider.start()
+
+    questions = [f"How do I configure feature {index} of my account?" for index in range(args.requests)]
+    results = {}
+    try:
+        for concurrency in (1, args.concurrency):
+            results[f"local_embedding/{args.local_embedding_backend}/concurrency={concurrency}"] = \
+                await run_concurrently(lambda index: provider.embed_query(questions[index]), args.requests,
+                                       concurrency)
+    finally:
+        await provider.stop()
+
+    return results
+
+
+async def bench_endpoint(args):
+    limits = httpx.Limits(max_connections=args.concurrency + 5)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=120, limits=limits) as client:
+        credentials = {"username": "benchmark_user", "password": "benchmark_password"}
+        await client.post("/auth/register", json=credentials)
+        response = await client.post("/auth/token", data=credentials)
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        faq_questions = itertools.cycle(["How do I deactivate my account?", "How do I change my profile information?"])
+        user_questions = [next(faq_questions) if index % 2 == 0 else f"What is the meaning of {index}?"
+                          for index in range(args.requests)]
+
+        async def ask_question(index):
+            response = await client.post("/questions/ask-question", json={"user_question": user_questions[index]},
+                                         headers=headers)
+            response.raise_for_status()
+
+        return {f"endpoint/concurrency={args.concurrency}": await run_concurrently(ask_question, args.requests,
+                                                                                     args.concurrency)}
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path, "r") as baseline_file:
+        baseline = json.load(baseline_file)["results"]
+
+    regressions = 0
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+
+        p95_ratio = result["p95_ms"] / baseline[key]["p95_ms"]
+        throughput_ratio = result["requests_per_second"] / baseline[key]["requests_per_second"]
+        is_regression = p95_ratio > 1 + tolerance or throughput_ratio < 1 - tolerance
+        regressions += is_regression
+
+        print(f"{'REGRESSION ' if is_regression else ''}{key}: p95 x{p95_ratio:.2f}, requests/sec x{throughput_ratio:.2f}")
+
+    return regressions
+
+
+async def main(args):
+    results = {}
+
+    if "similarity_search" in args.scenarios:
+        results.update(bench_similarity_search(args))
+    if "classifier" in args.scenarios:
+        results.update(await bench_classifier(args))
+    if "pipeline" in args.scenarios:
+        results.update(await bench_pipeline(args))
+    if "database" in args.scenarios:
+        results.update(bench_database(args))
+    if "local_embedding" in args.scenarios:
+        results.update(await bench_local_embedding(args))
+    if "endpoint" in args.scenarios:
+        results.update(await bench_endpoint(args))
+
+    for key, result in results.items():
+        print(f"{key}: p50 {result['p50_ms']:.2f}ms, p95 {result['p95_ms']:.2f}ms, p99 {result['p99_ms']:.2f}ms, "
+              f"{result['requests_per_second']:.1f} req/s")
+
+    if args.output:
+        report = {
+            "commit": current_commit(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "arguments": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+            "results": results
+        }
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.compare:
+        return 1 if compare(results, args.compare, args.tolerance) else 0
+    return 0
+
+
+def comma_separated(converter):
+    return lambda value: [converter(item) for item in value.split(",") if item]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", type=comma_separated(str), default=["similarity_search", "classifier",
+                                                                            "pipeline"],
+                        help=f"comma-separated, among {', '.join(ALL_SCENARIOS)}")
+    parser.add_argument("--faq-sizes", type=comma_separated(int), default=[10, 1000, 100000],
+                        help="up to 1000000, mind the memory: rows x dimension x 4 bytes")
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--embedding-latency-ms", type=float, default=50)
+    parser.add_argument("--completion-latency-ms", type=float, default=500)
+    parser.add_argument("--classifier-model", help="model directory or Hugging Face repository, default: stub")
+    parser.add_argument("--classifier-batch-latency-ms", type=float, default=20)
+    parser.add_argument("--classifier-item-latency-ms", type=float, default=2)
+    parser.add_argument("--classifier-max-batch-size", type=int, default=16)
+    parser.add_argument("--classifier-max-wait-ms", type=float, default=5)
+    parser.add_argument("--database-reloads", type=int, default=5)
+    parser.add_argument("--local-embedding-model", default="sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--local-embedding-backend", default="pytorch", choices=("pytorch", "onnx"))
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="JSON results of a previous run, exits with 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative slack before flagging a regression")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,104 @@
+"""Local stand-ins for the external dependencies of the QA pipeline, used by the benchmarks.
+
+- `create_openai_stub_app` mimics the OpenAI embeddings and (streaming) chat completions endpoints with configurable
+  latency. Embeddings are deterministic per input text, so the same question always gets the same vector.
+- `StubClassifier` mimics the transformers text-classification pipeline with a configurable per-batch and per-item
+  latency.
+
+Run the OpenAI stub as a server and point the app to it with `OPENAI_API_BASE_URL=http://localhost:9000/v1`:
+
+    python -m benchmarks.stubs --port 9000 --embedding-latency-ms 80 --completion-latency-ms 800
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+
+def stub_embedding(text, dimension):
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    embedding = np.random.default_rng(seed).standard_normal(dimension, dtype=np.float32)
+    return (embedding / np.linalg.norm(embedding)).tolist()
+
+
+def create_openai_stub_app(embedding_latency_ms=50, completion_latency_ms=500, dimension=1536, stream_chunks=20):
+    app = FastAPI()
+    app.state.requests = {"embeddings": 0, "completions": 0}
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        app.state.requests["embeddings"] += 1
+
+        await asyncio.sleep(embedding_latency_ms / 1000)
+
+        return {
+            "object": "list",
+            "model": body.get("model"),
+            "data": [{"object": "embedding", "index": index, "embedding": stub_embedding(text, dimension)}
+                     for index, text in enumerate(inputs)]
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        question = body["messages"][-1]["content"]
+        answer = f"Stub answer to: {question}"
+        app.state.requests["completions"] += 1
+
+        if not body.get("stream"):
+            await asyncio.sleep(completion_latency_ms / 1000)
+            return {"choices": [{"index": 0, "message": {"role": "assistant", "content": answer}}]}
+
+        words = answer.split(" ")
+        chunk_size = max(1, len(words) // stream_chunks)
+
+        async def chunks():
+            for start in range(0, len(words), chunk_size):
+                await asyncio.sleep(completion_latency_ms / 1000 / stream_chunks)
+                content = " ".join(words[start:start + chunk_size]) + " "
+                yield f"data: {json.dumps({'choices': [{'index': 0, 'delta': {'content': content}}]})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    return app
+
+
+class StubClassifier:
+    """Callable with the interface of the text-classification pipeline, labelling as IT-related the questions which
+    contain one of `it_keywords`."""
+
+    it_keywords = ("password", "account", "email", "network", "computer", "software", "install", "login")
+
+    def __init__(self, batch_latency_ms=20, item_latency_ms=2):
+        self.batch_latency_ms = batch_latency_ms
+        self.item_latency_ms = item_latency_ms
+
+    def __call__(self, inputs, batch_size=None, truncation=True):
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        time.sleep((self.batch_latency_ms + self.item_latency_ms * len(inputs)) / 1000)
+
+        return [{"label": "LABEL_1" if any(keyword in text.lower() for keyword in self.it_keywords) else "LABEL_0",
+                 "score": 0.99} for text in inputs]
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--embedding-latency-ms", type=float, default=50)
+    parser.add_argument("--completion-latency-ms", type=float, default=500)
+    parser.add_argument("--dimension", type=int, default=1536)
+    args = parser.parse_args()
+
+    uvicorn.run(create_openai_stub_app(args.embedding_latency_ms, args.completion_latency_ms, args.dimension),
+                host=args.host, port=args.port, log_level="warning")
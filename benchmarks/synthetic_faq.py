@@ -0,0 +1,81 @@
+"""Synthetic FAQ generator, from 10 to 1M entries, either in memory or loaded into the `embeddings` table.
+
+Only load it into a throwaway database: the rows are written to the real `embeddings` table (their questions are
+prefixed with `SYNTHETIC_PREFIX`, so `--delete` removes them again).
+
+    python -m benchmarks.synthetic_faq --rows 100000 --dimension 1536
+    python -m benchmarks.synthetic_faq --delete
+"""
+import argparse
+import time
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+import components.config.constants as constants
+import components.qa_system.database_operations as db
+from components.qa_system.embedding_codec import encode_embedding
+from components.qa_system.embedding_provider import embedding_provider
+
+SYNTHETIC_PREFIX = "[synthetic] "
+INSERT_SYNTHETIC_EMBEDDINGS_QUERY = "INSERT INTO embeddings (question, question_embedding_packed, answer, " \
+                                    "answer_embedding_packed, embedding_provider, embedding_dimension) VALUES %s " \
+                                    "ON CONFLICT (question) DO NOTHING"
+DELETE_SYNTHETIC_EMBEDDINGS_QUERY = "DELETE FROM embeddings WHERE question LIKE %s"
+
+
+def generate_faq(rows, dimension=1536, seed=0):
+    """Returns the questions, answers and an L2-normalized float32 (rows, dimension) question embedding matrix."""
+    rng = np.random.default_rng(seed)
+
+    question_embeddings = rng.standard_normal((rows, dimension), dtype=np.float32)
+    question_embeddings /= np.linalg.norm(question_embeddings, axis=1, keepdims=True)
+
+    questions = [f"{SYNTHETIC_PREFIX}How do I configure feature {index}?" for index in range(rows)]
+    answers = [f"Open the settings of feature {index} and follow the instructions." for index in range(rows)]
+
+    return questions, answers, question_embeddings
+
+
+def load_into_database(rows, dimension=1536, seed=0, batch_size=1000):
+    questions, answers, question_embeddings = generate_faq(rows, dimension, seed)
+
+    with db.get_connection() as conn:
+        with conn.cursor() as cursor:
+            for start in range(0, rows, batch_size):
+                packed_embeddings = [psycopg2.Binary(encode_embedding(question_embeddings[index],
+                                                                      constants.EMBEDDING_STORAGE_FORMAT))
+                                     for index in range(start, min(start + batch_size, rows))]
+                batch = [(questions[start + offset], packed_embedding, answers[start + offset], packed_embedding,
+                          embedding_provider.name, dimension)
+                         for offset, packed_embedding in enumerate(packed_embeddings)]
+                execute_values(cursor, INSERT_SYNTHETIC_EMBEDDINGS_QUERY, batch, page_size=batch_size)
+
+        if constants.EMBEDDINGS_BACKEND == "pgvector":
+            db.backfill_question_vectors(conn, batch_size)
+
+    return questions, answers, question_embeddings
+
+
+def delete_from_database():
+    with db.get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(DELETE_SYNTHETIC_EMBEDDINGS_QUERY, (SYNTHETIC_PREFIX + "%",))
+            return cursor.rowcount
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--delete", action="store_true", help="delete the synthetic rows instead of loading them")
+    args = parser.parse_args()
+
+    started_at = time.perf_counter()
+    if args.delete:
+        print(f"Deleted {delete_from_database()} synthetic rows")
+    else:
+        load_into_database(args.rows, args.dimension, args.seed)
+        print(f"Loaded {args.rows} synthetic rows in {time.perf_counter() - started_at:.1f}s")
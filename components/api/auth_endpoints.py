@@ -1,16 +1,24 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from typing import Optional
 
 from fastapi import HTTPException, Depends, status, APIRouter
 from fastapi.security import OAuth2PasswordRequestForm
-from jose import JWTError, jwt
+from jose import jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel
 
+from components.api.dependencies import oauth2_scheme, token_verifier, get_current_username
 from components.qa_system.database_operations import *
 
 router = APIRouter()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=constants.BCRYPT_ROUNDS)
+
+password_executor = ThreadPoolExecutor(max_workers=constants.PASSWORD_HASHING_MAX_WORKERS,
+                                       thread_name_prefix="password-hashing")
+password_semaphore = asyncio.Semaphore(constants.PASSWORD_HASHING_MAX_PENDING)
 
 
 class UserDetails(BaseModel):
@@ -22,15 +30,36 @@ class Token(BaseModel):
     refresh_token: str
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
+
+
+async def run_password_hashing(function, *args):
+    try:
+        await asyncio.wait_for(password_semaphore.acquire(), constants.PASSWORD_HASHING_QUEUE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Too many concurrent authentication requests", headers={"Retry-After": "1"})
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, function, *args)
+    finally:
+        password_semaphore.release()
+
+
+async def hash_password(plain_password):
+    return await run_password_hashing(pwd_context.hash, plain_password)
 
 
-def authenticate_user(username: str, password: str):
-    user = get_user_by_username(username)
+async def verify_password(plain_password, hashed_password):
+    return await run_password_hashing(pwd_context.verify, plain_password, hashed_password)
+
+
+async def authenticate_user(username: str, password: str):
+    user = await asyncio.to_thread(get_user_by_username, username)
     if not user:
         return False
-    if not verify_password(password, user.password):
+    if not await verify_password(password, user.password):
         return False
     return user
 
@@ -45,14 +74,14 @@ def create_token(data: dict, expires_delta: timedelta):
 
 @router.post("/register")
 async def register(user: UserDetails):
-    hashed_password = pwd_context.hash(user.password)
-    insert_into_users(user.username, hashed_password)
+    hashed_password = await hash_password(user.password)
+    await asyncio.to_thread(insert_into_users, user.username, hashed_password)
     return {"message": "User registered successfully"}
 
 
 @router.post("/token")
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user(form_data.username, form_data.password)
 
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
@@ -68,16 +97,22 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 
 @router.post("/refresh-token")
 async def refresh_token(token: Token):
-    try:
-        payload = jwt.decode(token.refresh_token, constants.JWT_SECRET_KEY, algorithms=[constants.JWT_ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+    # raises a 401 for invalid, expired or revoked refresh tokens
+    username: str = token_verifier.verify(token.refresh_token)["sub"]
+
+    access_token_expires = timedelta(minutes=constants.ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_token(data={"sub": username}, expires_delta=access_token_expires)
 
-        access_token_expires = timedelta(minutes=constants.ACCESS_TOKEN_EXPIRE_MINUTES)
-        access_token = create_token(data={"sub": username}, expires_delta=access_token_expires)
+    return {"access_token": access_token, "token_type": "bearer"}
 
-        return {"access_token": access_token, "token_type": "bearer"}
 
-    except JWTError:
+@router.post("/logout")
+async def logout(logout_request: LogoutRequest, access_token: str = Depends(oauth2_scheme),
+                 username: str = Depends(get_current_username)):
+    user = await asyncio.to_thread(get_user_by_username, username)
+    if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+
+    await asyncio.to_thread(token_verifier.revoke, user.id, access_token, logout_request.refresh_token)
+
+    return {"message": "User logged out successfully"}
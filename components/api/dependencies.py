@@ -0,0 +1,100 @@
+import asyncio
+import hashlib
+import logging
+import time
+
+from fastapi import HTTPException, Depends, status
+from fastapi.security import OAuth2PasswordBearer
+from jose import JWTError, jwt
+
+import components.config.constants as constants
+import components.qa_system.database_operations as db
+from components.qa_system.lru_cache import TTLLRUCache
+
+logger = logging.getLogger(__name__)
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def credentials_exception():
+    return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials",
+                         headers={"WWW-Authenticate": "Bearer"})
+
+
+class TokenVerifier:
+    """Verifies JWTs without touching the database on the hot path: already validated tokens are kept in an LRU cache
+    until their `exp`, and revocation is checked against an in-memory set of revoked token hashes which a background
+    task refreshes periodically from the `tokens` table."""
+
+    def __init__(self, cache_size, refresh_seconds):
+        self.refresh_seconds = refresh_seconds
+        self._validated_tokens = TTLLRUCache(cache_size, ttl_seconds=0)
+        self._revoked_token_hashes = frozenset()
+
+    def verify(self, token):
+        token_hash = hash_token(token)
+
+        if token_hash in self._revoked_token_hashes:
+            raise credentials_exception()
+
+        payload = self._validated_tokens.get(token_hash)
+        if payload is not None:
+            return payload
+
+        try:
+            payload = jwt.decode(token, constants.JWT_SECRET_KEY, algorithms=[constants.JWT_ALGORITHM])
+        except JWTError:
+            raise credentials_exception()
+
+        if payload.get("sub") is None or payload.get("exp") is None:
+            raise credentials_exception()
+
+        # never cached beyond the expiry of the token itself
+        self._validated_tokens.set(token_hash, payload, ttl_seconds=payload["exp"] - time.time())
+        return payload
+
+    def refresh_revocations(self):
+        # tokens revoked before the longest token lifetime have expired anyway
+        max_age_seconds = constants.REFRESH_TOKEN_EXPIRE_DAYS * 24 * 3600
+        self._revoked_token_hashes = frozenset(db.retrieve_revoked_token_hashes(max_age_seconds))
+
+    def revoke(self, user_id, access_token, refresh_token=None):
+        access_token_hash = hash_token(access_token)
+        refresh_token_hash = hash_token(refresh_token) if refresh_token else ""
+
+        db.insert_into_tokens(user_id, access_token_hash, refresh_token_hash)
+
+        # effective immediately on this worker, the other workers pick it up on their next refresh
+        self._revoked_token_hashes = self._revoked_token_hashes | {access_token_hash, refresh_token_hash} - {""}
+        self._validated_tokens.delete(access_token_hash)
+        self._validated_tokens.delete(refresh_token_hash)
+
+    async def run_revocation_refresher(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                await asyncio.to_thread(self.refresh_revocations)
+            except Exception as exception:
+                logger.warning(f"Error refreshing the token revocation list: {exception}")
+
+
+token_verifier = TokenVerifier(constants.TOKEN_CACHE_SIZE, constants.REVOCATION_LIST_REFRESH_SECONDS)
+
+
+async def get_token_payload(token: str = Depends(oauth2_scheme)):
+    return token_verifier.verify(token)
+
+
+async def get_current_username(payload: dict = Depends(get_token_payload)):
+    return payload["sub"]
+
+
+async def get_admin_username(username: str = Depends(get_current_username)):
+    # anyone can register, so being authenticated is not enough for the endpoints which affect every user
+    if username not in constants.ADMIN_USERNAMES:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Administrator privileges required")
+    return username
@@ -0,0 +1,36 @@
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse
+
+from components.qa_system.answer_cache import answer_cache
+from components.qa_system.embedding_cache import query_embedding_cache
+from components.qa_system.embedding_provider import embedding_provider
+from components.qa_system.model_registry import model_registry
+
+router = APIRouter()
+
+
+@router.get("/live")
+async def live():
+    return {"status": "alive"}
+
+
+@router.get("/ready")
+async def ready():
+    model_status = {**model_registry.status(), "embedding_provider": embedding_provider.name,
+                    "embedding_model_loaded": embedding_provider.is_loaded}
+
+    # a worker loading the classifier on first use is ready to serve before it is loaded
+    is_classifier_ready = model_registry.is_loaded or model_registry.load_on_first_use
+    if not is_classifier_ready or not embedding_provider.is_loaded:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            content={"status": "not ready", **model_status})
+
+    return {"status": "ready", **model_status}
+
+
+@router.get("/caches")
+async def caches():
+    return {
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "answer_cache": answer_cache.stats()
+    }
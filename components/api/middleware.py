@@ -0,0 +1,55 @@
+import contextvars
+import logging
+import re
+import time
+import uuid
+
+from fastapi import Request
+from prometheus_client import Histogram
+
+import components.config.constants as constants
+from components.qa_system.metrics import LATENCY_BUCKETS
+
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+VALID_REQUEST_ID = re.compile(r"^[\w.:/+=-]{1,128}$")
+
+HTTP_REQUEST_DURATION = Histogram("http_request_duration_seconds", "Duration of the HTTP requests, by route",
+                                  labelnames=("method", "route", "status"), buckets=LATENCY_BUCKETS)
+
+
+class RequestIdLogFilter(logging.Filter):
+    """Adds the id of the current request (or "-" outside of requests) to the log records as `request_id`."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+def install_request_id_log_filter():
+    # filters of the handlers apply to the records of all loggers, filters of the root logger only to its own
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(log_filter, RequestIdLogFilter) for log_filter in handler.filters):
+            handler.addFilter(RequestIdLogFilter())
+
+
+async def request_context_middleware(request: Request, call_next):
+    request_id = request.headers.get(constants.REQUEST_ID_HEADER, "")
+    if not VALID_REQUEST_ID.match(request_id):
+        request_id = uuid.uuid4().hex
+
+    token = request_id_var.set(request_id)
+    started_at = time.perf_counter()
+    status_code = 500
+
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        response.headers[constants.REQUEST_ID_HEADER] = request_id
+        return response
+    finally:
+        # the route template rather than the path, so the label cardinality stays bounded
+        route = request.scope.get("route")
+        HTTP_REQUEST_DURATION.labels(method=request.method, route=route.path if route else "unmatched",
+                                     status=status_code).observe(time.perf_counter() - started_at)
+        request_id_var.reset(token)
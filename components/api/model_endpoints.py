@@ -0,0 +1,51 @@
+import os
+from typing import Optional
+
+from fastapi import HTTPException, Depends, APIRouter, status
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+
+import components.config.constants as constants
+from components.api.dependencies import get_admin_username
+from components.exceptions.custom_exceptions import ModelReloadInProgressError
+from components.qa_system.metrics import snapshot
+from components.qa_system.model_registry import model_registry, classifier_batcher
+
+router = APIRouter()
+
+
+class ModelRevision(BaseModel):
+    revision: Optional[str] = None
+
+
+@router.get("/status")
+async def model_status():
+    return model_registry.status()
+
+
+@router.get("/batching")
+async def batching_metrics():
+    return {
+        "max_batch_size": classifier_batcher.max_batch_size,
+        "max_wait_ms": classifier_batcher.max_wait_seconds * 1000,
+        "batch_size": snapshot(classifier_batcher.batch_size),
+        "queue_wait_seconds": snapshot(classifier_batcher.queue_wait_seconds)
+    }
+
+
+@router.post("/reload")
+async def reload_model(model_revision: ModelRevision, username: str = Depends(get_admin_username)):
+    if model_revision.revision is not None and model_revision.revision not in constants.HF_MODEL_ALLOWED_REVISIONS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Revision {model_revision.revision} is not in HF_MODEL_ALLOWED_REVISIONS")
+
+    try:
+        # loading takes seconds, keep it off the event loop so the current model keeps serving in the meantime
+        await run_in_threadpool(model_registry.reload, model_revision.revision)
+    except ModelReloadInProgressError as exception:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exception))
+    except Exception as exception:
+        raise HTTPException(status_code=500, detail=f"Error reloading model: {exception}")
+
+    # only the worker which served the request is reloaded, see "Hot-reload the classifier" in the README
+    return {"message": "Model reloaded successfully", "worker_pid": os.getpid(), **model_registry.status()}
@@ -1,15 +1,26 @@
-from fastapi import HTTPException, Depends, status, APIRouter, Request
-from fastapi.security import OAuth2PasswordBearer
-from jose import jwt
-from pydantic import BaseModel
+import asyncio
+import io
+import json
+from typing import List, Optional
 
-from components.exceptions.custom_exceptions import NoOpenAIKeyError, RequestError
+from fastapi import HTTPException, Depends, status, APIRouter, Request, UploadFile
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+
+from components.api.dependencies import get_current_username, get_admin_username
+from components.exceptions.custom_exceptions import NoOpenAIKeyError, RequestError, ModelNotLoadedError
 from components.qa_system.database_operations import *
-from components.qa_system.faq_search import compute_embeddings, process_user_query
-from transformers import BertTokenizerFast, BertForSequenceClassification, pipeline
+from components.qa_system.answer_cache import answer_cache
+from components.qa_system.faq_ingestion import sync_faq_embeddings, ingest_faq_entries, read_faq_entries, \
+    get_file_format, FAQ_FILE_FORMATS
+from components.qa_system.embedding_provider import embedding_provider
+from components.qa_system.faq_search import process_user_query, process_user_queries, find_answer_without_openai, \
+    stream_answer_from_openai
+from components.qa_system.metrics import ANSWER_SOURCES, time_stage
+from components.qa_system.model_registry import classifier_batcher
 import logging
 
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=logging.INFO, format=constants.LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
@@ -19,85 +30,240 @@ class UserQuestion(BaseModel):
     user_question: str
 
 
+class UserQuestions(BaseModel):
+    user_questions: List[str] = Field(min_length=1, max_length=constants.MAX_BATCH_QUESTIONS)
+
+
+class FAQMatchResponse(BaseModel):
+    question: str
+    answer: str
+    score: float
+    question_similarity: float
+    answer_similarity: Optional[float] = None
+
+
 class AnswerResponse(BaseModel):
     source: str
     matched_question: str
     answer: str
+    matches: List[FAQMatchResponse] = []
+
+
+def build_answer_response(source, matched_question, answer, matches):
+    return AnswerResponse(source=source, matched_question=matched_question, answer=answer,
+                          matches=[FAQMatchResponse(question=match.question, answer=match.answer, score=match.score,
+                                                    question_similarity=match.question_score,
+                                                    answer_similarity=match.answer_score)
+                                   for match in matches])
+
+
+class BatchAnswerResponse(BaseModel):
+    answers: List[AnswerResponse]
 
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-HF_MODEL_REPO_NAME = os.getenv("HF_MODEL_REPO_NAME")
-HF_TOKEN = os.getenv("HF_TOKEN")
 
 def check_if_openai_api_key_exists():
-    if os.getenv("OPENAI_API_KEY"):
+    if constants.OPENAI_API_KEY:
         return True
     else:
         return False
 
 
-def load_model_and_tokenizer(model_path):
-    bert = BertForSequenceClassification.from_pretrained(model_path, token=HF_TOKEN)
-    tokenizer = BertTokenizerFast.from_pretrained(model_path, token=HF_TOKEN)
-    binary_classifier = pipeline("text-classification", model=bert, tokenizer=tokenizer)
-    return binary_classifier
+# TODO
+# separate the logic , Middleware from enpdoints ?
+async def classify_it_related_question(request: Request, user_question: UserQuestion):
+    try:
+        # concurrent requests are classified together in micro-batches
+        with time_stage("classifier"):
+            is_it_related = await classifier_batcher.submit(user_question.user_question)
+
+        request.state.is_it_related = is_it_related
+
+        return is_it_related
+
+    except ModelNotLoadedError as exception:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(exception))
+    except Exception as exception:
+        raise HTTPException(status_code=500, detail=str(exception))
+
 
+async def classify_it_related_questions(user_questions: UserQuestions):
+    try:
+        # submitted together, the questions are classified in as few padded batches as possible
+        with time_stage("classifier_batch"):
+            return await asyncio.gather(*(classifier_batcher.submit(user_question)
+                                          for user_question in user_questions.user_questions))
 
-def perform_binary_text_classification(user_question, binary_classifier):
-    label_mapping = {"LABEL_0": 0, "LABEL_1": 1}
+    except ModelNotLoadedError as exception:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(exception))
+    except Exception as exception:
+        raise HTTPException(status_code=500, detail=str(exception))
 
-    binary_classifier_result = binary_classifier(user_question.strip())
 
-    is_it_related = label_mapping[binary_classifier_result[0]["label"]] == 1
+async def settle_classification(classification):
+    if not classification.done() and constants.SKIP_OPENAI_FOR_NON_IT_QUESTIONS:
+        # the answer came from the local FAQ, so the verdict is not needed anymore
+        classification.cancel()
+        return
 
-    return is_it_related
+    try:
+        logger.info(f"is_it_related: {await classification}")
+    except asyncio.CancelledError:
+        pass
+    except HTTPException as exception:
+        logger.warning(f"Error classifying question: {exception.detail}")
 
 
-# TODO
-# separate the logic , Middleware from enpdoints ?
-async def classify_it_related_question(request: Request, user_question: UserQuestion):
+# STEP 4 - Design FastAPI Endpoint to post user's question
+@router.post("/ask-question")
+async def ask_question(user_question: UserQuestion, request: Request, username: str = Depends(get_current_username)):
     try:
-        binary_classifier = load_model_and_tokenizer(HF_MODEL_REPO_NAME)
-        is_it_related = perform_binary_text_classification(user_question.user_question, binary_classifier)
+        if not check_if_openai_api_key_exists():  # TRUE
+            raise NoOpenAIKeyError("No OpenAI API key found")
 
-        request.state.is_it_related = is_it_related
+        # the CPU-bound classifier runs on its own thread while the query is embedded and searched
+        classification = asyncio.create_task(classify_it_related_question(request, user_question))
+
+        try:
+            source, question, answer, matches = await process_user_query(
+                user_question.user_question, constants.SIMILARITY_THRESHOLD,
+                classification if constants.SKIP_OPENAI_FOR_NON_IT_QUESTIONS else None)
+        finally:
+            await settle_classification(classification)
+
+        ANSWER_SOURCES.labels(source=source).inc()
+        return build_answer_response(source, question, answer, matches)
+
+    except HTTPException:
+        raise
+    except NoOpenAIKeyError as exception:
+        raise HTTPException(status_code=500, detail=str(exception))
+    except psycopg2.Error as exception:
+        raise DatabaseError("Database error: " + str(exception))
+    except RequestError as exception:
+        raise HTTPException(status_code=500, detail=str(exception))
+    except Exception as exception:
+        raise HTTPException(status_code=500, detail=str(exception))
+
+
+@router.post("/ask-batch")
+async def ask_batch(user_questions: UserQuestions, username: str = Depends(get_current_username)):
+    try:
+        if not check_if_openai_api_key_exists():
+            raise NoOpenAIKeyError("No OpenAI API key found")
+
+        classification = asyncio.create_task(classify_it_related_questions(user_questions))
+
+        try:
+            results = await process_user_queries(
+                user_questions.user_questions, constants.SIMILARITY_THRESHOLD,
+                classification if constants.SKIP_OPENAI_FOR_NON_IT_QUESTIONS else None)
+        finally:
+            await settle_classification(classification)
 
+        for source, _, _, _ in results:
+            ANSWER_SOURCES.labels(source=source).inc()
+
+        return BatchAnswerResponse(answers=[build_answer_response(source, question, answer, matches)
+                                            for source, question, answer, matches in results])
+
+    except HTTPException:
+        raise
     except Exception as exception:
         raise HTTPException(status_code=500, detail=str(exception))
 
 
-# STEP 4 - Design FastAPI Endpoint to post user's question
-@router.post("/ask-question")
-async def ask_question(user_question: UserQuestion, request: Request, token: str = Depends(oauth2_scheme)):
+def format_server_sent_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_answer_events(user_question, source, matched_question, answer, user_question_embedding, matches):
     try:
-        payload = jwt.decode(token, constants.JWT_SECRET_KEY, algorithms=[constants.JWT_ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+        if answer is None:
+            chunks = []
+            async for content in stream_answer_from_openai(user_question):
+                chunks.append(content)
+                yield format_server_sent_event("token", {"content": content})
 
-        if not check_if_openai_api_key_exists():  # TRUE
+            answer = "".join(chunks)
+            answer_cache.set(user_question_embedding, answer)
+
+        ANSWER_SOURCES.labels(source=source).inc()
+        yield format_server_sent_event("answer", build_answer_response(source, matched_question, answer,
+                                                                       matches).model_dump())
+
+    except Exception as exception:
+        # the status line is already sent, errors can only be reported in the stream
+        yield format_server_sent_event("error", {"detail": str(exception)})
+
+
+@router.post("/ask-question/stream")
+async def ask_question_stream(user_question: UserQuestion, request: Request,
+                              username: str = Depends(get_current_username)):
+    try:
+        if not check_if_openai_api_key_exists():
             raise NoOpenAIKeyError("No OpenAI API key found")
 
-        conn = get_connection()
+        classification = asyncio.create_task(classify_it_related_question(request, user_question))
 
-        compute_embeddings(conn, constants.FAQ_DATABASE)
+        try:
+            source, question, answer, user_question_embedding, matches = await find_answer_without_openai(
+                user_question.user_question, constants.SIMILARITY_THRESHOLD,
+                classification if constants.SKIP_OPENAI_FOR_NON_IT_QUESTIONS else None)
+        finally:
+            await settle_classification(classification)
+
+    except HTTPException:
+        raise
+    except Exception as exception:
+        raise HTTPException(status_code=500, detail=str(exception))
 
-        source, question, answer = process_user_query(conn, user_question.user_question, constants.SIMILARITY_THRESHOLD)
-        await classify_it_related_question(request, user_question)
+    # local answers are sent as a single event, OpenAI answers are relayed token by token; when the client
+    # disconnects the response task is cancelled, which closes the upstream completion request
+    return StreamingResponse(stream_answer_events(user_question.user_question, source, question, answer,
+                                                  user_question_embedding, matches),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-        is_it_related = request.state.is_it_related
 
-        logger.info(is_it_related)
+@router.post("/sync-faq")
+async def sync_faq(username: str = Depends(get_admin_username)):
+    try:
+        if embedding_provider.uses_openai and not check_if_openai_api_key_exists():
+            raise NoOpenAIKeyError("No OpenAI API key found")
 
-        conn.close()
+        synced_entries = await sync_faq_embeddings(constants.FAQ_DATABASE)
 
-        return AnswerResponse(source=source, matched_question=question, answer=answer)
+        return {"message": "FAQ synced successfully", "synced_entries": synced_entries}
 
+    except HTTPException:
+        raise
     except NoOpenAIKeyError as exception:
         raise HTTPException(status_code=500, detail=str(exception))
-    except psycopg2.Error as exception:
-        raise DatabaseError("Database error: " + str(exception))
-    except RequestError as exception:
+    except Exception as exception:
         raise HTTPException(status_code=500, detail=str(exception))
+
+
+@router.post("/ingest-faq")
+async def ingest_faq(faq_file: UploadFile, username: str = Depends(get_admin_username)):
+    try:
+        if embedding_provider.uses_openai and not check_if_openai_api_key_exists():
+            raise NoOpenAIKeyError("No OpenAI API key found")
+
+        file_format = get_file_format(faq_file.filename or "")
+        if file_format not in FAQ_FILE_FORMATS:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Unsupported FAQ file format, expected one of {FAQ_FILE_FORMATS}")
+
+        # the upload is streamed from its spooled file, never read into memory at once
+        text_file = io.TextIOWrapper(faq_file.file, encoding="utf-8", newline="")
+        ingestion_result = await ingest_faq_entries(read_faq_entries(text_file, file_format))
+
+        return {"message": "FAQ ingested successfully", **ingestion_result}
+
+    except HTTPException:
+        raise
+    except (ValueError, KeyError) as exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid FAQ file: {exception}")
     except Exception as exception:
         raise HTTPException(status_code=500, detail=str(exception))
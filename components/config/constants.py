@@ -1,5 +1,6 @@
 import os
 import secrets
+import tempfile
 
 JWT_ALGORITHM = "HS256"
 JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
@@ -8,23 +9,206 @@ if JWT_SECRET_KEY is None:
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 30
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt runs on a dedicated thread pool of this size, so login bursts cannot starve the event loop
+PASSWORD_HASHING_MAX_WORKERS = int(os.getenv("PASSWORD_HASHING_MAX_WORKERS", "2"))
+# hashing requests beyond this number wait at most PASSWORD_HASHING_QUEUE_TIMEOUT_SECONDS, then get a 503
+PASSWORD_HASHING_MAX_PENDING = int(os.getenv("PASSWORD_HASHING_MAX_PENDING", "32"))
+PASSWORD_HASHING_QUEUE_TIMEOUT_SECONDS = float(os.getenv("PASSWORD_HASHING_QUEUE_TIMEOUT_SECONDS", "5"))
 CONTENT_TYPE = "application/json"
+# an incoming request id is reused (so logs can be correlated across services), otherwise one is generated;
+# either way it is returned in the response and added to every log record of the request
+REQUEST_ID_HEADER = os.getenv("REQUEST_ID_HEADER", "X-Request-ID")
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"
 EMBEDDING_MODEL = "text-embedding-3-small"
+# "openai" embeds with EMBEDDING_MODEL through the OpenAI API, "local" with the sentence-embedding model
+# LOCAL_EMBEDDING_MODEL on the CPU of each worker, through PyTorch or, with LOCAL_EMBEDDING_BACKEND="onnx", its
+# (int8-quantized) ONNX export LOCAL_EMBEDDING_ONNX_FILE
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+LOCAL_EMBEDDING_BACKEND = os.getenv("LOCAL_EMBEDDING_BACKEND", "pytorch")
+LOCAL_EMBEDDING_ONNX_FILE = os.getenv("LOCAL_EMBEDDING_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+LOCAL_EMBEDDING_THREADS = int(os.getenv("LOCAL_EMBEDDING_THREADS", "0"))
+LOCAL_EMBEDDING_MAX_LENGTH = 256
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+LOCAL_EMBEDDING_MAX_WAIT_MS = float(os.getenv("LOCAL_EMBEDDING_MAX_WAIT_MS", "2"))
 OPENAI_GET_ANSWER_MODEL = "gpt-4-turbo-preview"
-OPENAI_API_URL_EMBEDDINGS = "https://api.openai.com/v1/embeddings"
-OPENAI_API_URL_COMPLETIONS = "https://api.openai.com/v1/chat/completions"
-INSERT_INTO_EMBEDDINGS_TABLE_QUERY = "INSERT INTO embeddings (question, question_embedding, answer, answer_embedding) " \
-                                     "VALUES (%s, %s, %s, %s)" \
-                                     "ON CONFLICT (question) DO UPDATE " \
-                                     "SET question_embedding = EXCLUDED.question_embedding," \
-                                     "answer = EXCLUDED.answer," \
-                                     "answer_embedding = EXCLUDED.answer_embedding"
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# point it to a local stub server for tests and benchmarks
+OPENAI_API_BASE_URL = os.getenv("OPENAI_API_BASE_URL", "https://api.openai.com/v1")
+OPENAI_API_URL_EMBEDDINGS = f"{OPENAI_API_BASE_URL}/embeddings"
+OPENAI_API_URL_COMPLETIONS = f"{OPENAI_API_BASE_URL}/chat/completions"
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "30"))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "5"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+# embeddings and chat completions have their own connection pool and in-flight limit, so slow completions never
+# delay the short embedding call every question needs
+OPENAI_EMBEDDINGS_MAX_CONCURRENCY = int(os.getenv("OPENAI_EMBEDDINGS_MAX_CONCURRENCY", "10"))
+OPENAI_COMPLETIONS_MAX_CONCURRENCY = int(os.getenv("OPENAI_COMPLETIONS_MAX_CONCURRENCY", "10"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+OPENAI_BACKOFF_BASE_SECONDS = float(os.getenv("OPENAI_BACKOFF_BASE_SECONDS", "0.5"))
+OPENAI_BACKOFF_MAX_SECONDS = float(os.getenv("OPENAI_BACKOFF_MAX_SECONDS", "20"))
 INSERT_INTO_USERS_TABLE_QUERY = "INSERT INTO users (username, password) VALUES (%s, %s)"
-INSERT_INTO_TOKENS_TABLE_QUERY = "INSERT INTO tokens (username, access_token, refresh_token) VALUES (%s, %s, %s)"
-GET_TOKENS_QUERY = "SELECT access_token, refresh_token FROM tokens WHERE username = %s"
+# the tokens table holds the SHA-256 hashes of revoked (logged out) tokens
+INSERT_INTO_TOKENS_TABLE_QUERY = "INSERT INTO tokens (user_id, access_token, refresh_token) VALUES (%s, %s, %s)"
+GET_REVOKED_TOKENS_QUERY = "SELECT access_token, refresh_token FROM tokens " \
+                           "WHERE created_at > NOW() - %s * INTERVAL '1 second'"
+# the only users allowed to change what every other user is answered with (FAQ ingestion and sync, model reloads);
+# comma-separated usernames, nobody when unset
+ADMIN_USERNAMES = frozenset(username.strip() for username in os.getenv("ADMIN_USERNAMES", "").split(",")
+                            if username.strip())
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+REVOCATION_LIST_REFRESH_SECONDS = float(os.getenv("REVOCATION_LIST_REFRESH_SECONDS", "30"))
 GET_USER_QUERY = "SELECT * FROM users WHERE username = %s"
-GET_EMBEDDINGS_QUERY = "SELECT id, question, question_embedding, answer  FROM embeddings"
+GET_EMBEDDINGS_QUERY = "SELECT id, question, question_embedding_packed, answer, answer_embedding_packed " \
+                       "FROM embeddings WHERE question_embedding_packed IS NOT NULL AND embedding_provider = %s"
+# the entries embedded by another provider are not returned, so the next sync re-embeds them
+GET_EMBEDDING_HASHES_QUERY = "SELECT question, content_hash FROM embeddings WHERE embedding_provider = %s"
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+PGVECTOR_MIGRATIONS_DIR = os.path.join(MIGRATIONS_DIR, "pgvector")
+# "numpy" scores the FAQ in-process, "pgvector" pushes the nearest-neighbour search into PostgreSQL; "jsonb", its name
+# from when the embeddings were stored as JSONB, is still accepted for "numpy"
+EMBEDDINGS_BACKEND = os.getenv("EMBEDDINGS_BACKEND", "numpy")
+if EMBEDDINGS_BACKEND == "jsonb":
+    EMBEDDINGS_BACKEND = "numpy"
+EMBEDDING_DIMENSION = 1536
+# embeddings are stored packed in BYTEA columns: "float32" (6 KB per 1536-dim vector), "float16" (half of it, lossless
+# for cosine similarity in practice) or "int8" (a quarter, quantized with a per-vector scale)
+EMBEDDING_STORAGE_FORMAT = os.getenv("EMBEDDING_STORAGE_FORMAT", "float32")
+EMBEDDING_MIGRATION_BATCH_SIZE = 1000
+GET_JSONB_EMBEDDINGS_QUERY = "SELECT id, question_embedding, answer_embedding FROM embeddings " \
+                             "WHERE question_embedding_packed IS NULL AND question_embedding IS NOT NULL " \
+                             "ORDER BY id LIMIT %s"
+# the JSONB copies are cleared once packed, VACUUM FULL embeddings reclaims their space
+UPDATE_PACKED_EMBEDDINGS_QUERY = "UPDATE embeddings " \
+                                 "SET question_embedding_packed = packed.question_embedding, " \
+                                 "answer_embedding_packed = packed.answer_embedding, " \
+                                 "question_embedding = NULL, answer_embedding = NULL " \
+                                 "FROM (VALUES %s) AS packed (id, question_embedding, answer_embedding) " \
+                                 "WHERE embeddings.id = packed.id"
+GET_MISSING_QUESTION_VECTORS_QUERY = "SELECT id, question_embedding_packed FROM embeddings " \
+                                     "WHERE question_vector IS NULL AND question_embedding_packed IS NOT NULL " \
+                                     "ORDER BY id LIMIT %s"
+UPDATE_QUESTION_VECTORS_QUERY = "UPDATE embeddings SET question_vector = vectors.question_vector::vector " \
+                                "FROM (VALUES %s) AS vectors (id, question_vector) " \
+                                "WHERE embeddings.id = vectors.id"
+SEARCH_EMBEDDINGS_PGVECTOR_QUERY = "SELECT answer, question, 1 - (question_vector <=> %(query)s::vector) " \
+                                   "FROM embeddings " \
+                                   "WHERE question_vector <=> %(query)s::vector <= 1 - %(threshold)s " \
+                                   "AND embedding_provider = %(provider)s " \
+                                   "ORDER BY question_vector <=> %(query)s::vector " \
+                                   "LIMIT %(limit)s"
+# first retrieval stage of the re-ranking: the nearest questions, whatever their similarity, with their answer embedding
+SEARCH_CANDIDATES_PGVECTOR_QUERY = "SELECT answer, question, 1 - (question_vector <=> %(query)s::vector), " \
+                                   "answer_embedding_packed " \
+                                   "FROM embeddings " \
+                                   "WHERE embedding_provider = %(provider)s " \
+                                   "ORDER BY question_vector <=> %(query)s::vector " \
+                                   "LIMIT %(limit)s"
+# bulk FAQ ingestion packs this many inputs (2 per FAQ entry) into each embeddings request, within the token budget
+INGESTION_MAX_INPUTS_PER_REQUEST = int(os.getenv("INGESTION_MAX_INPUTS_PER_REQUEST", "512"))
+INGESTION_MAX_TOKENS_PER_REQUEST = int(os.getenv("INGESTION_MAX_TOKENS_PER_REQUEST", "200000"))
+# the embeddings endpoint rejects the whole request when a single input is longer, such entries are skipped
+INGESTION_MAX_TOKENS_PER_INPUT = int(os.getenv("INGESTION_MAX_TOKENS_PER_INPUT", "8191"))
+INGESTION_CONCURRENCY = int(os.getenv("INGESTION_CONCURRENCY", "4"))
+INSERT_EMBEDDINGS_BATCH_QUERY = "INSERT INTO embeddings (question, answer, question_embedding_packed, " \
+                                "answer_embedding_packed, content_hash, embedding_provider, embedding_dimension) " \
+                                "VALUES %s " \
+                                "ON CONFLICT (question) DO UPDATE " \
+                                "SET question_embedding_packed = EXCLUDED.question_embedding_packed, " \
+                                "answer = EXCLUDED.answer, " \
+                                "answer_embedding_packed = EXCLUDED.answer_embedding_packed, " \
+                                "content_hash = EXCLUDED.content_hash, " \
+                                "embedding_provider = EXCLUDED.embedding_provider, " \
+                                "embedding_dimension = EXCLUDED.embedding_dimension"
+INSERT_EMBEDDINGS_BATCH_WITH_VECTOR_QUERY = "INSERT INTO embeddings (question, answer, question_embedding_packed, " \
+                                            "answer_embedding_packed, content_hash, embedding_provider, " \
+                                            "embedding_dimension, question_vector) VALUES %s " \
+                                            "ON CONFLICT (question) DO UPDATE " \
+                                            "SET question_embedding_packed = EXCLUDED.question_embedding_packed, " \
+                                            "answer = EXCLUDED.answer, " \
+                                            "answer_embedding_packed = EXCLUDED.answer_embedding_packed, " \
+                                            "content_hash = EXCLUDED.content_hash, " \
+                                            "embedding_provider = EXCLUDED.embedding_provider, " \
+                                            "embedding_dimension = EXCLUDED.embedding_dimension, " \
+                                            "question_vector = EXCLUDED.question_vector"
+# production launch (components/config/gunicorn.conf.py): preforked uvicorn workers sharing the preloaded classifier
+SERVER_BIND = os.getenv("SERVER_BIND", "0.0.0.0:8000")
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "2"))
+FAQ_SYNC_ON_STARTUP = os.getenv("FAQ_SYNC_ON_STARTUP", "true").lower() == "true"
+# the workers starting together run the migrations and the FAQ sync one at a time, under this advisory lock, so only
+# the first one does the work
+STARTUP_ADVISORY_LOCK_QUERY = "SELECT pg_advisory_lock(hashtext('qa_assistant_startup'))"
+STARTUP_ADVISORY_UNLOCK_QUERY = "SELECT pg_advisory_unlock(hashtext('qa_assistant_startup'))"
+# with the numpy backend, one worker publishes the FAQ matrix to a snapshot file which all the workers memory-map,
+# instead of each worker loading its own copy (see components/qa_system/faq_snapshot.py); off for a single process,
+# components/config/gunicorn.conf.py turns it on when it runs several workers
+FAQ_INDEX_SHARED = os.getenv("FAQ_INDEX_SHARED", "false").lower() == "true"
+FAQ_INDEX_SNAPSHOT_PATH = os.getenv("FAQ_INDEX_SNAPSHOT_PATH",
+                                    os.path.join(tempfile.gettempdir(), "qa_faq_index", "faq_index.snapshot"))
+# how often a worker looks for a newer snapshot, and how long the publisher waits for more FAQ changes before
+# publishing, so a bulk ingestion results in one new version rather than one per batch
+FAQ_INDEX_SNAPSHOT_CHECK_SECONDS = float(os.getenv("FAQ_INDEX_SNAPSHOT_CHECK_SECONDS", "1"))
+FAQ_INDEX_PUBLISH_DELAY_SECONDS = float(os.getenv("FAQ_INDEX_PUBLISH_DELAY_SECONDS", "1"))
+FAQ_INDEX_PUBLISHER_ELECTION_SECONDS = 5
+LISTEN_FAQ_EMBEDDINGS_CHANGED_QUERY = "LISTEN faq_embeddings_changed"
+GET_CACHED_QUERY_EMBEDDING_QUERY = "SELECT embedding FROM query_embedding_cache " \
+                                   "WHERE cache_key = %s AND created_at > NOW() - %s * INTERVAL '1 second'"
+# batch variants, one round-trip for all the questions of an /ask-batch request
+GET_CACHED_QUERY_EMBEDDINGS_QUERY = "SELECT cache_key, embedding FROM query_embedding_cache " \
+                                    "WHERE cache_key = ANY(%s) AND created_at > NOW() - %s * INTERVAL '1 second'"
+INSERT_INTO_QUERY_EMBEDDING_CACHE_BATCH_QUERY = "INSERT INTO query_embedding_cache (cache_key, model, embedding) " \
+                                                "VALUES %s " \
+                                                "ON CONFLICT (cache_key) DO UPDATE " \
+                                                "SET embedding = EXCLUDED.embedding, created_at = CURRENT_TIMESTAMP"
+INSERT_INTO_QUERY_EMBEDDING_CACHE_QUERY = "INSERT INTO query_embedding_cache (cache_key, model, embedding) " \
+                                          "VALUES (%s, %s, %s) " \
+                                          "ON CONFLICT (cache_key) DO UPDATE " \
+                                          "SET embedding = EXCLUDED.embedding, created_at = CURRENT_TIMESTAMP"
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "10000"))
+QUERY_EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("QUERY_EMBEDDING_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+QUERY_EMBEDDING_CACHE_SHARED_TIER = os.getenv("QUERY_EMBEDDING_CACHE_SHARED_TIER", "true").lower() == "true"
+# the TTL only filters the reads, so the expired rows of the shared tier are deleted this often
+QUERY_EMBEDDING_CACHE_PURGE_SECONDS = float(os.getenv("QUERY_EMBEDDING_CACHE_PURGE_SECONDS", "3600"))
+DELETE_EXPIRED_QUERY_EMBEDDINGS_QUERY = "DELETE FROM query_embedding_cache " \
+                                        "WHERE created_at <= NOW() - %s * INTERVAL '1 second'"
 SIMILARITY_THRESHOLD = 0.8
+# matches returned per question, re-ranked among the RETRIEVAL_CANDIDATES most similar FAQ questions by
+# (1 - RERANK_ANSWER_WEIGHT) * question similarity + RERANK_ANSWER_WEIGHT * answer similarity
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+RERANK_ANSWER_WEIGHT = float(os.getenv("RERANK_ANSWER_WEIGHT", "0.0"))
+MAX_BATCH_QUESTIONS = int(os.getenv("MAX_BATCH_QUESTIONS", "100"))
+BATCH_OPENAI_CONCURRENCY = int(os.getenv("BATCH_OPENAI_CONCURRENCY", "4"))
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+HF_MODEL_REPO_NAME = os.getenv("HF_MODEL_REPO_NAME")
+HF_MODEL_REVISION = os.getenv("HF_MODEL_REVISION")
+HF_TOKEN = os.getenv("HF_TOKEN")
+# the only revisions /models/reload accepts (comma-separated branches, tags or commits), besides HF_MODEL_REVISION
+HF_MODEL_ALLOWED_REVISIONS = frozenset(revision.strip()
+                                       for revision in os.getenv("HF_MODEL_ALLOWED_REVISIONS", "").split(",")
+                                       if revision.strip()) | ({HF_MODEL_REVISION} if HF_MODEL_REVISION else set())
+# "pytorch" runs the full-precision model through the transformers pipeline, "onnx" runs the int8-quantized export
+# (CLASSIFIER_ONNX_FILE, relative to the model repository) with ONNX Runtime
+CLASSIFIER_BACKEND = os.getenv("CLASSIFIER_BACKEND", "pytorch")
+CLASSIFIER_ONNX_FILE = os.getenv("CLASSIFIER_ONNX_FILE", "onnx/model_quantized.onnx")
+# 0 lets ONNX Runtime use all the cores, lower it when several workers share the machine
+CLASSIFIER_ONNX_THREADS = int(os.getenv("CLASSIFIER_ONNX_THREADS", "0"))
+CLASSIFIER_WARM_UP_QUESTION = "How do I reset my password?"
+CLASSIFIER_LABEL_MAPPING = {"LABEL_0": 0, "LABEL_1": 1}
+CLASSIFIER_MAX_BATCH_SIZE = int(os.getenv("CLASSIFIER_MAX_BATCH_SIZE", "16"))
+CLASSIFIER_MAX_WAIT_MS = float(os.getenv("CLASSIFIER_MAX_WAIT_MS", "5"))
+# "false" defers loading the classifier, and importing torch/transformers, to the first question it classifies
+CLASSIFIER_LOAD_ON_STARTUP = os.getenv("CLASSIFIER_LOAD_ON_STARTUP", "true").lower() == "true"
+# the workers write their metrics to files in this directory, which /metrics aggregates (prometheus_client
+# multiprocess mode); it is emptied when gunicorn starts
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR",
+                                     os.path.join(tempfile.gettempdir(), "qa_prometheus_metrics"))
+SERVER_TIMEOUT_SECONDS = int(os.getenv("SERVER_TIMEOUT_SECONDS", "120"))
+SKIP_OPENAI_FOR_NON_IT_QUESTIONS = os.getenv("SKIP_OPENAI_FOR_NON_IT_QUESTIONS", "false").lower() == "true"
+NON_IT_QUESTION_ANSWER = "This assistant only answers IT-related questions."
 FAQ_DATABASE = [
     {
         "question": "How do I change my profile information?",
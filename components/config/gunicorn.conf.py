@@ -0,0 +1,57 @@
+"""Production launch: `gunicorn -c components/config/gunicorn.conf.py entrypoint:app`
+
+The app is imported once by the master, which also loads the PyTorch classifier before forking the uvicorn workers,
+so the model weights are shared copy-on-write instead of being loaded once per worker.
+"""
+import gc
+import os
+import shutil
+import sys
+
+import components.config.constants as constants
+
+# set before the app, and prometheus_client, is imported; the files of the previous run are removed, unless the
+# configuration is being reloaded by a running master
+if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = constants.PROMETHEUS_MULTIPROC_DIR
+    shutil.rmtree(constants.PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+bind = constants.SERVER_BIND
+workers = constants.SERVER_WORKERS
+
+# the shared FAQ snapshot is also what propagates the FAQ changes made through one worker to the others, so it is on
+# by default with several workers; set before the app, which builds the FAQ index at import, is imported
+if "FAQ_INDEX_SHARED" not in os.environ:
+    constants.FAQ_INDEX_SHARED = workers > 1
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = constants.SERVER_TIMEOUT_SECONDS
+preload_app = True
+
+
+def when_ready(server):
+    # ONNX Runtime sessions own thread pools which do not survive a fork, the workers load that backend themselves
+    if constants.CLASSIFIER_BACKEND == "pytorch" and constants.CLASSIFIER_LOAD_ON_STARTUP:
+        from components.qa_system.model_registry import model_registry
+
+        try:
+            # no warm-up inference, the intra-op thread pool must be started by each worker, after the fork
+            model_registry.load(warm_up=False)
+        except Exception as exception:
+            server.log.exception(f"Error preloading the classifier, the workers load it themselves: {exception}")
+
+    # the objects created so far are never scanned by the garbage collector of the workers, scanning them would
+    # write to, and copy, the shared pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # each worker gets its share of the cores, instead of every worker running one inference thread per core
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
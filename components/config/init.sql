@@ -11,7 +11,20 @@ CREATE TABLE embeddings
     question           TEXT,
     question_embedding JSONB,
     answer             TEXT,
-    answer_embedding   JSONB
+    answer_embedding   JSONB,
+    content_hash       TEXT,
+    question_embedding_packed BYTEA,
+    answer_embedding_packed   BYTEA,
+    embedding_provider        TEXT,
+    embedding_dimension       INTEGER
+);
+
+CREATE TABLE query_embedding_cache
+(
+    cache_key  TEXT PRIMARY KEY,
+    model      TEXT      NOT NULL,
+    embedding  JSONB     NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
 
 CREATE TABLE tokens
@@ -0,0 +1,3 @@
+-- Hash of each FAQ question/answer pair, used by the FAQ sync to skip unchanged entries
+ALTER TABLE embeddings
+    ADD COLUMN IF NOT EXISTS content_hash TEXT;
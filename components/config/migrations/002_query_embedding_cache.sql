@@ -0,0 +1,8 @@
+-- Shared tier of the query embedding cache, keyed by the hash of the embedding model and the normalized question
+CREATE TABLE IF NOT EXISTS query_embedding_cache
+(
+    cache_key  TEXT PRIMARY KEY,
+    model      TEXT      NOT NULL,
+    embedding  JSONB     NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,10 @@
+-- Packed binary embeddings (see components/qa_system/embedding_codec.py), replacing the JSONB text representation;
+-- the existing JSONB rows are converted at startup by migrate_embeddings_to_packed
+ALTER TABLE embeddings
+    ADD COLUMN IF NOT EXISTS question_embedding_packed BYTEA,
+    ADD COLUMN IF NOT EXISTS answer_embedding_packed   BYTEA;
+
+-- packed floats do not compress, skip the TOAST compression attempt
+ALTER TABLE embeddings
+    ALTER COLUMN question_embedding_packed SET STORAGE EXTERNAL,
+    ALTER COLUMN answer_embedding_packed SET STORAGE EXTERNAL;
@@ -0,0 +1,17 @@
+-- Notifies the FAQ snapshot publisher (components/qa_system/faq_snapshot_publisher.py) once per statement changing
+-- the FAQ, whichever process or host ran it; the workers starting together apply this one at a time
+SELECT pg_advisory_xact_lock(hashtext('004_embeddings_notify'));
+
+CREATE OR REPLACE FUNCTION notify_faq_embeddings_changed() RETURNS trigger AS
+$$
+BEGIN
+    PERFORM pg_notify('faq_embeddings_changed', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER embeddings_changed_notify
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+    ON embeddings
+    FOR EACH STATEMENT
+EXECUTE FUNCTION notify_faq_embeddings_changed();
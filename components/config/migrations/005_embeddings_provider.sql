@@ -0,0 +1,18 @@
+-- Provider ("openai:<model>" or "local:<model>") and dimension of the stored embeddings, the FAQ is only searched
+-- with the embeddings of the active provider and the entries embedded by another one are re-embedded by the sync
+ALTER TABLE embeddings
+    ADD COLUMN IF NOT EXISTS embedding_provider  TEXT,
+    ADD COLUMN IF NOT EXISTS embedding_dimension INTEGER;
+
+-- the rows stored before were all embedded by OpenAI; guarded, so the FAQ is not reported as changed at every startup
+DO
+$$
+BEGIN
+    IF EXISTS (SELECT 1 FROM embeddings WHERE embedding_provider IS NULL) THEN
+        UPDATE embeddings
+        SET embedding_provider  = 'openai:text-embedding-3-small',
+            embedding_dimension = 1536
+        WHERE embedding_provider IS NULL;
+    END IF;
+END
+$$;
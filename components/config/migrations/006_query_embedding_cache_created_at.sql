@@ -0,0 +1,2 @@
+-- The expired entries of the query embedding cache are deleted periodically, by their creation time
+CREATE INDEX IF NOT EXISTS query_embedding_cache_created_at_idx ON query_embedding_cache (created_at);
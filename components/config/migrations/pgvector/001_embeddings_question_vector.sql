@@ -0,0 +1,14 @@
+-- Only applied when EMBEDDINGS_BACKEND=pgvector; the dimension must match constants.EMBEDDING_DIMENSION
+CREATE EXTENSION IF NOT EXISTS vector;
+
+ALTER TABLE embeddings
+    ADD COLUMN IF NOT EXISTS question_vector vector(1536);
+
+-- migrate the rows written by the JSONB backend
+UPDATE embeddings
+SET question_vector = (question_embedding::text)::vector
+WHERE question_vector IS NULL
+  AND question_embedding IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS embeddings_question_vector_hnsw_idx
+    ON embeddings USING hnsw (question_vector vector_cosine_ops);
@@ -24,3 +24,11 @@ class DatabaseError(CustomError):
 
 class NoOpenAIKeyError(CustomError):
     """Exception raised when no API key for OpenAI is found."""
+
+
+class ModelNotLoadedError(CustomError):
+    """Exception raised when the IT-relatedness classifier is used before it has been loaded."""
+
+
+class ModelReloadInProgressError(CustomError):
+    """Exception raised when the IT-relatedness classifier is reloaded while another reload is running."""
@@ -1,6 +1,11 @@
+import numpy as np
+
+
 class Embedding:
-    def __init__(self, id: int, question: str, question_embedding: str, answer: str):
+    def __init__(self, id: int, question: str, question_embedding: np.ndarray, answer: str,
+                 answer_embedding: np.ndarray = None):
         self.id = id
         self.question = question
         self.question_embedding = question_embedding
         self.answer = answer
+        self.answer_embedding = answer_embedding
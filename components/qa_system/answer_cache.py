@@ -0,0 +1,90 @@
+import threading
+import time
+
+import numpy as np
+from prometheus_client import Counter
+
+import components.config.constants as constants
+from components.qa_system.faq_index import normalize_embeddings
+from components.qa_system.metrics import snapshot
+
+ANSWER_CACHE_LOOKUPS = Counter("answer_cache_lookups_total", "Semantic answer cache lookups", labelnames=("result",))
+
+
+class SemanticAnswerCache:
+    """Cache of OpenAI fallback completions looked up by meaning rather than by text: a new query reuses the answer
+    of a previously answered query whose embedding is at least `similarity_threshold` cosine-similar.
+
+    Entries live in a preallocated float32 matrix of normalized query embeddings, so a lookup is one matrix-vector
+    product; they expire after `ttl_seconds` and the least recently used one is evicted when the cache is full.
+
+    The cached answers are served to other users, so the questions they answered are never stored."""
+
+    def __init__(self, max_size, ttl_seconds, similarity_threshold):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.lookups = ANSWER_CACHE_LOOKUPS
+        self._lock = threading.Lock()
+        self._embeddings = None
+        self._answers = [None] * max_size
+        self._expires_at = np.zeros(max_size)
+        self._last_used = np.zeros(max_size)
+
+    def __len__(self):
+        return int(np.count_nonzero(self._expires_at > time.monotonic()))
+
+    def get(self, query_embedding):
+        query = normalize_embeddings(query_embedding)[0]
+        now = time.monotonic()
+
+        with self._lock:
+            if self._embeddings is None or self._embeddings.shape[1] != query.shape[0]:
+                self.lookups.labels(result="miss").inc()
+                return None
+
+            scores = self._embeddings @ query
+            scores[self._expires_at <= now] = -np.inf
+
+            best_index = int(np.argmax(scores))
+            if scores[best_index] < self.similarity_threshold:
+                self.lookups.labels(result="miss").inc()
+                return None
+
+            self._last_used[best_index] = now
+            self.lookups.labels(result="hit").inc()
+            return self._answers[best_index], float(scores[best_index])
+
+    def set(self, query_embedding, answer):
+        query = normalize_embeddings(query_embedding)[0]
+        now = time.monotonic()
+
+        with self._lock:
+            if self._embeddings is None or self._embeddings.shape[1] != query.shape[0]:
+                # (re)allocated on first use, or when the embedding model changed
+                self._embeddings = np.zeros((self.max_size, query.shape[0]), dtype=np.float32)
+                self._expires_at[:] = 0
+
+            # a free or expired slot if there is one, otherwise the least recently used entry
+            expired = np.flatnonzero(self._expires_at <= now)
+            slot = int(expired[0]) if len(expired) else int(np.argmin(self._last_used))
+
+            self._embeddings[slot] = query
+            self._answers[slot] = answer
+            self._expires_at[slot] = now + self.ttl_seconds
+            self._last_used[slot] = now
+
+    def clear(self):
+        with self._lock:
+            self._expires_at[:] = 0
+
+    def stats(self):
+        return {
+            "size": len(self),
+            "max_size": self.max_size,
+            "lookups": snapshot(self.lookups)
+        }
+
+
+answer_cache = SemanticAnswerCache(constants.ANSWER_CACHE_SIZE, constants.ANSWER_CACHE_TTL_SECONDS,
+                                   constants.ANSWER_CACHE_SIMILARITY_THRESHOLD)
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from prometheus_client import Histogram
+
+from components.qa_system.metrics import LATENCY_BUCKETS, BATCH_SIZE_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Dynamic batching queue: callers enqueue single items, a background worker collects up to `max_batch_size`
+    items or waits at most `max_wait_ms` after the first one, and runs them through `process_batch` in one call.
+
+    `process_batch` is a blocking function mapping a list of items to a list of results of the same length, it runs
+    on a dedicated thread so the event loop is never blocked by the forward pass."""
+
+    def __init__(self, name, process_batch, max_batch_size, max_wait_ms):
+        self.name = name
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000
+        self.batch_size = Histogram(f"{name}_batch_size", f"Number of items per {name} batch",
+                                    buckets=BATCH_SIZE_BUCKETS)
+        self.queue_wait_seconds = Histogram(f"{name}_queue_wait_seconds",
+                                            f"Time an item waits in the {name} queue before its batch runs",
+                                            buckets=LATENCY_BUCKETS)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._queue = None
+        self._worker = None
+
+    @property
+    def is_running(self):
+        return self._worker is not None and not self._worker.done()
+
+    async def start(self):
+        if not self.is_running:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        while self._queue is not None and not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError(f"The {self.name} batcher has been stopped"))
+
+    async def submit(self, item):
+        if not self.is_running:
+            await self.start()
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future, time.perf_counter()))
+        return await future
+
+    async def run(self, function, *args):
+        """Runs `function` on the thread of the batches, e.g. a bulk call to the same model, so the two never run
+        forward passes at the same time."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def _collect_batch(self):
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_seconds
+
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        # callers which went away (e.g. client disconnects) are not worth a slot in the forward pass
+        return [entry for entry in batch if not entry[1].done()]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = await self._collect_batch()
+            if not batch:
+                continue
+
+            started_at = time.perf_counter()
+            self.batch_size.observe(len(batch))
+            for _, _, enqueued_at in batch:
+                self.queue_wait_seconds.observe(started_at - enqueued_at)
+
+            try:
+                results = await loop.run_in_executor(self._executor, self.process_batch,
+                                                     [item for item, _, _ in batch])
+            except Exception as exception:
+                logger.exception(f"Error processing {self.name} batch of {len(batch)} items")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(exception)
+                continue
+
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
@@ -1,12 +1,19 @@
 import json
 import os
+import threading
+import time
+from contextlib import contextmanager
 
 import psycopg2
+from psycopg2 import extensions, pool
+from psycopg2.extras import execute_values
 
 import components.config.constants as constants
 from components.exceptions.custom_exceptions import DatabaseError
 from components.models.Embedding import Embedding
 from components.models.User import User
+from components.qa_system.embedding_codec import encode_embedding, decode_embedding
+from components.qa_system.metrics import UPSTREAM_ERRORS, time_stage
 
 # PostgreSQL
 POSTGRES_DB = os.getenv("POSTGRES_DB")
@@ -14,27 +21,186 @@ POSTGRES_USER = os.getenv("POSTGRES_USER")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
 POSTGRES_HOST = os.getenv("POSTGRES_HOST")
 POSTGRES_PORT = os.getenv("POSTGRES_PORT")
+POSTGRES_POOL_MIN_SIZE = int(os.getenv("POSTGRES_POOL_MIN_SIZE", "1"))
+POSTGRES_POOL_MAX_SIZE = int(os.getenv("POSTGRES_POOL_MAX_SIZE", "10"))
+POSTGRES_POOL_TIMEOUT_SECONDS = float(os.getenv("POSTGRES_POOL_TIMEOUT_SECONDS", "5"))
+# connections idle for longer than this are pinged before being handed out
+POSTGRES_POOL_HEALTH_CHECK_SECONDS = float(os.getenv("POSTGRES_POOL_HEALTH_CHECK_SECONDS", "30"))
 
 
+class ConnectionPool:
+    """Thread-safe pool of PostgreSQL connections shared by all endpoints of a worker. Checkouts block up to
+    `timeout` seconds when all connections are in use and connections are health-checked before being handed out."""
+
+    def __init__(self, min_size, max_size, timeout, health_check_seconds, **connect_kwargs):
+        self.timeout = timeout
+        self.health_check_seconds = health_check_seconds
+        self.max_size = max_size
+        self._pool = pool.ThreadedConnectionPool(min_size, max_size, **connect_kwargs)
+        self._available = threading.BoundedSemaphore(max_size)
+        self._last_used = {}
+
+    def _is_healthy(self, conn):
+        if conn.closed or conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+
+        last_used = self._last_used.get(id(conn))
+        if last_used is None or time.monotonic() - last_used < self.health_check_seconds:
+            return True
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        if not self._available.acquire(timeout=self.timeout):
+            raise DatabaseError(f"No database connection available after {self.timeout}s")
+
+        try:
+            # after a database restart every pooled connection may be broken, they are replaced one by one
+            for _ in range(self.max_size + 1):
+                conn = self._pool.getconn()
+                if self._is_healthy(conn):
+                    return conn
+                self._last_used.pop(id(conn), None)
+                self._pool.putconn(conn, close=True)
+
+            raise DatabaseError("No healthy database connection available")
+        except Exception:
+            self._available.release()
+            raise
+
+    def putconn(self, conn):
+        try:
+            if not conn.closed and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if conn.closed:
+                self._last_used.pop(id(conn), None)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+            self._pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self._available.release()
+
+    def close(self):
+        self._pool.closeall()
+
+
+_connection_pool = None
+_connection_pool_lock = threading.Lock()
+
+
+def init_connection_pool(min_size=POSTGRES_POOL_MIN_SIZE, max_size=POSTGRES_POOL_MAX_SIZE):
+    global _connection_pool
+
+    with _connection_pool_lock:
+        if _connection_pool is None:
+            try:
+                _connection_pool = ConnectionPool(min_size, max_size, POSTGRES_POOL_TIMEOUT_SECONDS,
+                                                  POSTGRES_POOL_HEALTH_CHECK_SECONDS, dbname=POSTGRES_DB,
+                                                  user=POSTGRES_USER, password=POSTGRES_PASSWORD,
+                                                  host=POSTGRES_HOST, port=POSTGRES_PORT)
+            except psycopg2.OperationalError as exception:
+                raise DatabaseError(f"Error connection to database: {exception}")
+
+    return _connection_pool
+
+
+def close_connection_pool():
+    global _connection_pool
+
+    with _connection_pool_lock:
+        if _connection_pool is not None:
+            _connection_pool.close()
+            _connection_pool = None
+
+
+@contextmanager
 def get_connection():
+    """Checks a connection out of the pool, commits on success, rolls back on error and always returns it."""
+    connection_pool = _connection_pool or init_connection_pool()
+
     try:
-        conn = psycopg2.connect(dbname=POSTGRES_DB, user=POSTGRES_USER, password=POSTGRES_PASSWORD, host=POSTGRES_HOST,
-                                port=POSTGRES_PORT)
-        return conn
-    except psycopg2.OperationalError as exception:
+        with time_stage("db_connection_checkout"):
+            conn = connection_pool.getconn()
+    except (psycopg2.Error, DatabaseError) as exception:
+        UPSTREAM_ERRORS.labels(upstream="postgres", reason=type(exception).__name__).inc()
+        if isinstance(exception, DatabaseError):
+            raise
         raise DatabaseError(f"Error connection to database: {exception}")
 
+    try:
+        yield conn
+        conn.commit()
+    except Exception as exception:
+        if isinstance(exception, (psycopg2.Error, DatabaseError)):
+            UPSTREAM_ERRORS.labels(upstream="postgres", reason=type(exception).__name__).inc()
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        connection_pool.putconn(conn)
 
-def insert_into_embeddings(conn, cursor, current_question, current_answer, current_question_embedding,
-                           current_answer_embedding):
+
+@contextmanager
+def startup_lock(conn):
+    """Holds the session-level startup advisory lock on `conn` for the enclosed block, across its commits."""
     try:
-        cursor.execute(constants.INSERT_INTO_EMBEDDINGS_TABLE_QUERY,
-                       (current_question, json.dumps(current_question_embedding), current_answer,
-                        json.dumps(current_answer_embedding)))
+        with conn.cursor() as cursor:
+            cursor.execute(constants.STARTUP_ADVISORY_LOCK_QUERY)
         conn.commit()
     except psycopg2.Error as exception:
         conn.rollback()
-        raise DatabaseError(f"Error inserting data into database: {exception}")
+        raise DatabaseError(f"Error acquiring the startup lock: {exception}")
+
+    try:
+        yield
+    finally:
+        # the lock is released with the session anyway if the connection is broken
+        if not conn.closed:
+            conn.rollback()
+            with conn.cursor() as cursor:
+                cursor.execute(constants.STARTUP_ADVISORY_UNLOCK_QUERY)
+            conn.commit()
+
+
+def apply_migrations(conn, migrations_dir=constants.MIGRATIONS_DIR):
+    try:
+        with conn.cursor() as cursor:
+            for migration_file in sorted(os.listdir(migrations_dir)):
+                if migration_file.endswith(".sql"):
+                    with open(os.path.join(migrations_dir, migration_file), "r") as migration:
+                        cursor.execute(migration.read())
+        conn.commit()
+    except psycopg2.Error as exception:
+        conn.rollback()
+        raise DatabaseError(f"Error applying database migrations: {exception}")
+
+
+def insert_embeddings_batch(rows, embedding_provider, storage_format=constants.EMBEDDING_STORAGE_FORMAT):
+    """Upserts (question, answer, question_embedding, answer_embedding, content_hash) rows in a single transaction."""
+    with_vector = constants.EMBEDDINGS_BACKEND == "pgvector"
+
+    values = [(question, answer, psycopg2.Binary(encode_embedding(question_embedding, storage_format)),
+               psycopg2.Binary(encode_embedding(answer_embedding, storage_format)), content_hash,
+               embedding_provider, len(question_embedding))
+              + ((json.dumps(question_embedding),) if with_vector else ())
+              for question, answer, question_embedding, answer_embedding, content_hash in rows]
+
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                if with_vector:
+                    execute_values(cursor, constants.INSERT_EMBEDDINGS_BATCH_WITH_VECTOR_QUERY, values,
+                                   template="(%s, %s, %s, %s, %s, %s, %s, %s::vector)", page_size=len(values))
+                else:
+                    execute_values(cursor, constants.INSERT_EMBEDDINGS_BATCH_QUERY, values, page_size=len(values))
+    except psycopg2.Error as exception:
+        raise DatabaseError(f"Error inserting embeddings into database: {exception}")
 
 
 def insert_into_users(username, hashed_password):
@@ -42,9 +208,7 @@ def insert_into_users(username, hashed_password):
         with get_connection() as conn:
             with conn.cursor() as cursor:
                 cursor.execute(constants.INSERT_INTO_USERS_TABLE_QUERY, (username, hashed_password))
-                conn.commit()
     except psycopg2.Error as exception:
-        conn.rollback()
         raise DatabaseError(f"Error insert user in users: {exception}")
 
 
@@ -57,23 +221,215 @@ def get_user_by_username(username: str):
                 if user_data:
                     return User(id=user_data[0], username=user_data[1], password=user_data[2])
     except psycopg2.Error as exception:
-        conn.rollback()
         raise DatabaseError(f"Error get user by username from users: {exception}")
 
 
-def retrieve_embeddings_from_database(conn):
+def retrieve_embeddings_from_database(conn, embedding_provider):
     try:
-        with conn.cursor() as cursor:
-            cursor.execute(constants.GET_EMBEDDINGS_QUERY)
+        with conn.cursor() as cursor, time_stage("db_retrieve_embeddings"):
+            cursor.execute(constants.GET_EMBEDDINGS_QUERY, (embedding_provider,))
             conn.commit()
             rows = cursor.fetchall()
 
             embeddings = []
 
             for row in rows:
-                embedding = Embedding(id=row[0], question=row[1], question_embedding=row[2], answer=row[3])
+                embedding = Embedding(id=row[0], question=row[1], question_embedding=decode_embedding(row[2]),
+                                      answer=row[3],
+                                      answer_embedding=decode_embedding(row[4]) if row[4] is not None else None)
                 embeddings.append(embedding)
 
         return embeddings
     except psycopg2.Error as exception:
         raise DatabaseError(f"Error retrieving embeddings from database: {exception}")
+
+
+def migrate_embeddings_to_packed(conn, storage_format=constants.EMBEDDING_STORAGE_FORMAT,
+                                 batch_size=constants.EMBEDDING_MIGRATION_BATCH_SIZE):
+    """Converts the rows still holding JSONB embeddings to packed ones, batch by batch so the conversion can be
+    interrupted and resumed. Returns the number of converted rows."""
+    migrated_rows = 0
+
+    try:
+        with conn.cursor() as cursor:
+            while True:
+                cursor.execute(constants.GET_JSONB_EMBEDDINGS_QUERY, (batch_size,))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+
+                packed_rows = [(row_id,
+                                psycopg2.Binary(encode_embedding(question_embedding, storage_format)),
+                                psycopg2.Binary(encode_embedding(answer_embedding, storage_format))
+                                if answer_embedding is not None else None)
+                               for row_id, question_embedding, answer_embedding in rows]
+                execute_values(cursor, constants.UPDATE_PACKED_EMBEDDINGS_QUERY, packed_rows,
+                               template="(%s, %s::bytea, %s::bytea)", page_size=batch_size)
+                conn.commit()
+                migrated_rows += len(rows)
+
+        return migrated_rows
+    except psycopg2.Error as exception:
+        conn.rollback()
+        raise DatabaseError(f"Error migrating embeddings to the packed format: {exception}")
+
+
+def backfill_question_vectors(conn, batch_size=constants.EMBEDDING_MIGRATION_BATCH_SIZE):
+    """Fills the pgvector `question_vector` column of the rows which only have a packed embedding."""
+    backfilled_rows = 0
+
+    try:
+        with conn.cursor() as cursor:
+            while True:
+                cursor.execute(constants.GET_MISSING_QUESTION_VECTORS_QUERY, (batch_size,))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+
+                vector_rows = [(row_id, json.dumps(decode_embedding(packed_embedding).tolist()))
+                               for row_id, packed_embedding in rows]
+                execute_values(cursor, constants.UPDATE_QUESTION_VECTORS_QUERY, vector_rows, page_size=batch_size)
+                conn.commit()
+                backfilled_rows += len(rows)
+
+        return backfilled_rows
+    except psycopg2.Error as exception:
+        conn.rollback()
+        raise DatabaseError(f"Error backfilling the question vectors: {exception}")
+
+
+def retrieve_embedding_hashes(conn, embedding_provider):
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(constants.GET_EMBEDDING_HASHES_QUERY, (embedding_provider,))
+            rows = cursor.fetchall()
+
+        return {question: content_hash for question, content_hash in rows}
+    except psycopg2.Error as exception:
+        raise DatabaseError(f"Error retrieving embedding hashes from database: {exception}")
+
+
+def search_embeddings_pgvector(conn, query_embedding, similarity_threshold, limit, embedding_provider):
+    try:
+        with conn.cursor() as cursor, time_stage("db_vector_search"):
+            cursor.execute(constants.SEARCH_EMBEDDINGS_PGVECTOR_QUERY,
+                           {"query": json.dumps(query_embedding), "threshold": similarity_threshold, "limit": limit,
+                            "provider": embedding_provider})
+            rows = cursor.fetchall()
+
+        return [(answer, question, float(similarity)) for answer, question, similarity in rows]
+    except psycopg2.Error as exception:
+        conn.rollback()
+        raise DatabaseError(f"Error searching embeddings in database: {exception}")
+
+
+def open_notification_connection(listen_query):
+    """Opens a connection of its own, outside the pool, listening to the notifications of `listen_query`."""
+    try:
+        conn = psycopg2.connect(dbname=POSTGRES_DB, user=POSTGRES_USER, password=POSTGRES_PASSWORD,
+                                host=POSTGRES_HOST, port=POSTGRES_PORT)
+        # notifications are only delivered outside of a transaction
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(listen_query)
+        return conn
+    except psycopg2.Error as exception:
+        UPSTREAM_ERRORS.labels(upstream="postgres", reason=type(exception).__name__).inc()
+        raise DatabaseError(f"Error opening the notification connection: {exception}")
+
+
+def search_candidates_pgvector(conn, query_embedding, limit, embedding_provider):
+    """Returns the (answer, question, question similarity, answer embedding) of the `limit` nearest questions."""
+    try:
+        with conn.cursor() as cursor, time_stage("db_vector_search"):
+            cursor.execute(constants.SEARCH_CANDIDATES_PGVECTOR_QUERY,
+                           {"query": json.dumps(query_embedding), "limit": limit, "provider": embedding_provider})
+            rows = cursor.fetchall()
+
+        return [(answer, question, float(similarity),
+                 decode_embedding(answer_embedding) if answer_embedding is not None else None)
+                for answer, question, similarity, answer_embedding in rows]
+    except psycopg2.Error as exception:
+        conn.rollback()
+        raise DatabaseError(f"Error searching embeddings in database: {exception}")
+
+
+def get_cached_query_embedding(cache_key, ttl_seconds):
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cursor, time_stage("db_query_embedding_cache"):
+                cursor.execute(constants.GET_CACHED_QUERY_EMBEDDING_QUERY, (cache_key, ttl_seconds))
+                row = cursor.fetchone()
+
+        return row[0] if row else None
+    except psycopg2.Error as exception:
+        raise DatabaseError(f"Error retrieving cached query embedding from database: {exception}")
+
+
+def insert_into_query_embedding_cache(cache_key, model, embedding):
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(constants.INSERT_INTO_QUERY_EMBEDDING_CACHE_QUERY,
+                               (cache_key, model, json.dumps(embedding)))
+    except psycopg2.Error as exception:
+        raise DatabaseError(f"Error inserting query embedding into cache: {exception}")
+
+
+def get_cached_query_embeddings(cache_keys, ttl_seconds):
+    """Returns the cached embeddings of `cache_keys` which have not expired, by cache key."""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cursor, time_stage("db_query_embedding_cache"):
+                cursor.execute(constants.GET_CACHED_QUERY_EMBEDDINGS_QUERY, (list(cache_keys), ttl_seconds))
+                rows = cursor.fetchall()
+
+        return {cache_key: embedding for cache_key, embedding in rows}
+    except psycopg2.Error as exception:
+        raise DatabaseError(f"Error retrieving cached query embeddings from database: {exception}")
+
+
+def insert_into_query_embedding_cache_batch(rows):
+    """Upserts the (cache_key, model, embedding) rows in a single statement."""
+    # a statement cannot update the same row twice, the last embedding of a repeated key wins
+    rows_by_key = {cache_key: (cache_key, model, json.dumps(embedding)) for cache_key, model, embedding in rows}
+
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                execute_values(cursor, constants.INSERT_INTO_QUERY_EMBEDDING_CACHE_BATCH_QUERY,
+                               list(rows_by_key.values()), page_size=max(1, len(rows_by_key)))
+    except psycopg2.Error as exception:
+        raise DatabaseError(f"Error inserting query embeddings into cache: {exception}")
+
+
+def delete_expired_query_embeddings(ttl_seconds):
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(constants.DELETE_EXPIRED_QUERY_EMBEDDINGS_QUERY, (ttl_seconds,))
+                return cursor.rowcount
+    except psycopg2.Error as exception:
+        raise DatabaseError(f"Error deleting expired query embeddings from cache: {exception}")
+
+
+def insert_into_tokens(user_id, access_token_hash, refresh_token_hash):
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(constants.INSERT_INTO_TOKENS_TABLE_QUERY,
+                               (user_id, access_token_hash, refresh_token_hash))
+    except psycopg2.Error as exception:
+        raise DatabaseError(f"Error inserting revoked tokens into tokens: {exception}")
+
+
+def retrieve_revoked_token_hashes(max_age_seconds):
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(constants.GET_REVOKED_TOKENS_QUERY, (max_age_seconds,))
+                rows = cursor.fetchall()
+
+        return {token_hash for row in rows for token_hash in row if token_hash}
+    except psycopg2.Error as exception:
+        raise DatabaseError(f"Error retrieving revoked tokens from tokens: {exception}")
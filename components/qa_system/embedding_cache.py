@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import logging
+import unicodedata
+
+from prometheus_client import Counter
+
+import components.config.constants as constants
+import components.qa_system.database_operations as db
+from components.qa_system.lru_cache import TTLLRUCache
+from components.qa_system.metrics import snapshot
+
+logger = logging.getLogger(__name__)
+
+QUERY_EMBEDDING_CACHE_LOOKUPS = Counter("query_embedding_cache_lookups_total",
+                                        "Query embedding cache lookups, by the tier which answered them",
+                                        labelnames=("result",))
+
+
+def normalize_question(question):
+    # NFKC folds the Unicode variants of the same character, casefold() is a more aggressive lower()
+    return " ".join(unicodedata.normalize("NFKC", question).casefold().split())
+
+
+class QueryEmbeddingCache:
+    """Two-tier cache of query embeddings keyed by the embedding model and the normalized question: an in-memory
+    LRU tier with TTL per worker, backed by the `query_embedding_cache` table shared by all workers."""
+
+    def __init__(self, max_size, ttl_seconds, shared_tier=True,
+                 purge_seconds=constants.QUERY_EMBEDDING_CACHE_PURGE_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.purge_seconds = purge_seconds
+        self.shared_tier = shared_tier
+        self.memory_tier = TTLLRUCache(max_size, ttl_seconds)
+        self.lookups = QUERY_EMBEDDING_CACHE_LOOKUPS
+
+    @staticmethod
+    def cache_key(question, model):
+        return hashlib.sha256(f"{model}\n{normalize_question(question)}".encode("utf-8")).hexdigest()
+
+    async def get(self, question, model):
+        cache_key = self.cache_key(question, model)
+
+        embedding = self.memory_tier.get(cache_key)
+        if embedding is not None:
+            self.lookups.labels(result="memory_hit").inc()
+            return embedding
+
+        if not self.shared_tier:
+            self.lookups.labels(result="miss").inc()
+            return None
+
+        try:
+            embedding = await asyncio.to_thread(db.get_cached_query_embedding, cache_key, self.ttl_seconds)
+        except Exception as exception:
+            # the shared tier is an optimization, an unavailable database must not fail the query
+            logger.warning(f"Error reading the query embedding cache: {exception}")
+            embedding = None
+
+        if embedding is not None:
+            self.lookups.labels(result="postgres_hit").inc()
+            self.memory_tier.set(cache_key, embedding)
+            return embedding
+
+        self.lookups.labels(result="miss").inc()
+        return None
+
+    async def get_many(self, questions, model):
+        """Batch variant of get(): the embeddings of `questions`, None for the misses, with at most one query to the
+        shared tier."""
+        cache_keys = [self.cache_key(question, model) for question in questions]
+        embeddings = [self.memory_tier.get(cache_key) for cache_key in cache_keys]
+        missing_keys = {cache_key for cache_key, embedding in zip(cache_keys, embeddings) if embedding is None}
+
+        shared_embeddings = {}
+        if missing_keys and self.shared_tier:
+            try:
+                shared_embeddings = await asyncio.to_thread(db.get_cached_query_embeddings, missing_keys,
+                                                            self.ttl_seconds)
+            except Exception as exception:
+                logger.warning(f"Error reading the query embedding cache: {exception}")
+
+        for index, cache_key in enumerate(cache_keys):
+            if embeddings[index] is not None:
+                self.lookups.labels(result="memory_hit").inc()
+            elif cache_key in shared_embeddings:
+                self.lookups.labels(result="postgres_hit").inc()
+                embeddings[index] = shared_embeddings[cache_key]
+                self.memory_tier.set(cache_key, embeddings[index])
+            else:
+                self.lookups.labels(result="miss").inc()
+
+        return embeddings
+
+    async def set_many(self, questions, model, embeddings):
+        cache_keys = [self.cache_key(question, model) for question in questions]
+        for cache_key, embedding in zip(cache_keys, embeddings):
+            self.memory_tier.set(cache_key, embedding)
+
+        if not self.shared_tier or not cache_keys:
+            return
+
+        try:
+            rows = [(cache_key, model, embedding) for cache_key, embedding in zip(cache_keys, embeddings)]
+            await asyncio.to_thread(db.insert_into_query_embedding_cache_batch, rows)
+        except Exception as exception:
+            logger.warning(f"Error writing the query embedding cache: {exception}")
+
+    async def set(self, question, model, embedding):
+        cache_key = self.cache_key(question, model)
+        self.memory_tier.set(cache_key, embedding)
+
+        if not self.shared_tier:
+            return
+
+        try:
+            await asyncio.to_thread(db.insert_into_query_embedding_cache, cache_key, model, embedding)
+        except Exception as exception:
+            logger.warning(f"Error writing the query embedding cache: {exception}")
+
+    async def run_purger(self):
+        # every worker runs it, deleting rows another worker already deleted is a no-op
+        while True:
+            await asyncio.sleep(self.purge_seconds)
+            try:
+                deleted_rows = await asyncio.to_thread(db.delete_expired_query_embeddings, self.ttl_seconds)
+                if deleted_rows:
+                    logger.info(f"Deleted {deleted_rows} expired query embeddings from the cache")
+            except Exception as exception:
+                logger.warning(f"Error deleting the expired query embeddings: {exception}")
+
+    def hit_rate(self):
+        lookups = {entry["labels"]["result"]: entry["value"] for entry in snapshot(self.lookups)}
+        total = sum(lookups.values())
+        return (total - lookups.get("miss", 0)) / total if total else 0.0
+
+    def stats(self):
+        return {
+            "size": len(self.memory_tier),
+            "lookups": snapshot(self.lookups),
+            "hit_rate": self.hit_rate()
+        }
+
+
+query_embedding_cache = QueryEmbeddingCache(constants.QUERY_EMBEDDING_CACHE_SIZE,
+                                            constants.QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+                                            shared_tier=constants.QUERY_EMBEDDING_CACHE_SHARED_TIER)
@@ -0,0 +1,63 @@
+import struct
+
+import numpy as np
+
+from components.exceptions.custom_exceptions import EmbeddingError
+
+# every packed embedding starts with a 4-byte header holding its format code, so rows written with different
+# formats can coexist and be decoded without knowing the current EMBEDDING_STORAGE_FORMAT
+HEADER = struct.Struct("<B3x")
+INT8_SCALE = struct.Struct("<f")
+
+FORMAT_CODES = {"float32": 1, "float16": 2, "int8": 3}
+FORMAT_NAMES = {code: name for name, code in FORMAT_CODES.items()}
+
+
+def encode_embedding(embedding, storage_format="float32"):
+    """Packs an embedding into little-endian bytes: float32 (4 bytes per dimension), float16 (2 bytes) or int8
+    quantized with a per-vector float32 scale (1 byte per dimension)."""
+    if storage_format not in FORMAT_CODES:
+        raise EmbeddingError(f"Unknown embedding storage format: {storage_format}")
+
+    embedding = np.asarray(embedding, dtype=np.float32).ravel()
+    header = HEADER.pack(FORMAT_CODES[storage_format])
+
+    if storage_format == "float32":
+        return header + embedding.astype("<f4").tobytes()
+
+    if storage_format == "float16":
+        return header + embedding.astype("<f2").tobytes()
+
+    # symmetric quantization, the largest component maps to +-127
+    max_abs = float(np.max(np.abs(embedding))) if embedding.size else 0.0
+    scale = max_abs / 127 if max_abs > 0 else 1.0
+    quantized = np.clip(np.rint(embedding / scale), -127, 127).astype(np.int8)
+    return header + INT8_SCALE.pack(scale) + quantized.tobytes()
+
+
+def decode_embedding(data):
+    """Unpacks bytes written by encode_embedding into a float32 array, straight from the buffer with np.frombuffer
+    (psycopg2 returns BYTEA columns as memoryviews)."""
+    if data is None:
+        return None
+
+    try:
+        (format_code,) = HEADER.unpack_from(data)
+    except struct.error:
+        raise EmbeddingError("Packed embedding is too short to hold its header")
+
+    storage_format = FORMAT_NAMES.get(format_code)
+
+    if storage_format == "float32":
+        # a read-only view on the row buffer, no copy until the FAQ index normalizes the matrix
+        return np.frombuffer(data, dtype="<f4", offset=HEADER.size)
+
+    if storage_format == "float16":
+        return np.frombuffer(data, dtype="<f2", offset=HEADER.size).astype(np.float32)
+
+    if storage_format == "int8":
+        (scale,) = INT8_SCALE.unpack_from(data, HEADER.size)
+        quantized = np.frombuffer(data, dtype=np.int8, offset=HEADER.size + INT8_SCALE.size)
+        return quantized.astype(np.float32) * np.float32(scale)
+
+    raise EmbeddingError(f"Unknown packed embedding format code: {format_code}")
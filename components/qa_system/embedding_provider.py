@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+import components.config.constants as constants
+from components.exceptions.custom_exceptions import EmbeddingError
+from components.qa_system.batching import MicroBatcher
+from components.qa_system.metrics import time_stage
+from components.qa_system.openai_client import openai_client, EMBEDDINGS
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingProvider(ABC):
+    """Embeds the FAQ entries and the user questions. `name` is recorded with every stored embedding, so the FAQ is
+    only ever compared with queries embedded by the same provider."""
+
+    name = None
+    uses_openai = False
+
+    @property
+    def is_loaded(self):
+        return True
+
+    @property
+    @abstractmethod
+    def dimension(self):
+        pass
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    @abstractmethod
+    async def embed(self, texts):
+        """Returns the embedding of each text, as a list of floats, in the order of `texts`."""
+
+    async def embed_query(self, text):
+        return (await self.embed([text]))[0]
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    name = f"openai:{constants.EMBEDDING_MODEL}"
+    uses_openai = True
+
+    @property
+    def dimension(self):
+        return constants.EMBEDDING_DIMENSION
+
+    async def embed(self, texts):
+        response = await get_embeddings_from_openai(texts)
+
+        if response.status_code != 200:
+            raise EmbeddingError(f"Error computing embeddings: {response.status_code}")
+
+        return [embedding["embedding"] for embedding in sorted(response.json()["data"],
+                                                               key=lambda embedding: embedding["index"])]
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """Sentence-embedding model loaded once per worker, no network round-trip. Concurrent questions are embedded
+    together in micro-batches, bulk inputs (FAQ sync, batch questions) in length-sorted batches."""
+
+    def __init__(self, model_path, backend, max_batch_size, max_wait_ms):
+        self.name = f"local:{model_path}"
+        self.model_path = model_path
+        self.backend = backend
+        self._model = None
+        self._lock = threading.Lock()
+        self.batcher = MicroBatcher("embedding", self._encode, max_batch_size=max_batch_size,
+                                    max_wait_ms=max_wait_ms)
+
+    @property
+    def is_loaded(self):
+        return self._model is not None
+
+    @property
+    def dimension(self):
+        return self._load().dimension
+
+    def _load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    # imported here, so the OpenAI provider never loads transformers
+                    from components.qa_system.local_embedding_model import load_local_embedding_model
+
+                    self._model = load_local_embedding_model(self.model_path, backend=self.backend)
+                    logger.info(f"Loaded {self.backend} embedding model {self.model_path} "
+                                f"({self._model.dimension} dimensions)")
+        return self._model
+
+    def _encode(self, texts):
+        return self._load().encode(texts).tolist()
+
+    async def start(self):
+        await asyncio.to_thread(self._load)
+        await self.batcher.start()
+
+    async def stop(self):
+        await self.batcher.stop()
+
+    async def embed(self, texts):
+        # every forward pass already uses all the intra-op threads, concurrent bulk calls (ingestion, /ask-batch)
+        # and micro-batches would only oversubscribe the cores, so they all share the single thread of the batcher
+        with time_stage("embedding"):
+            return await self.batcher.run(self._encode, list(texts))
+
+    async def embed_query(self, text):
+        with time_stage("embedding"):
+            return await self.batcher.submit(text)
+
+
+def create_embedding_provider(provider=constants.EMBEDDING_PROVIDER):
+    if provider == "openai":
+        return OpenAIEmbeddingProvider()
+    if provider == "local":
+        return LocalEmbeddingProvider(constants.LOCAL_EMBEDDING_MODEL, constants.LOCAL_EMBEDDING_BACKEND,
+                                      max_batch_size=constants.LOCAL_EMBEDDING_BATCH_SIZE,
+                                      max_wait_ms=constants.LOCAL_EMBEDDING_MAX_WAIT_MS)
+    raise ValueError(f"Unsupported embedding provider: {provider}, expected 'openai' or 'local'")
+
+
+embedding_provider = create_embedding_provider()
+
+
+# Function to compute embeddings for a given input data using OpenAI API
+async def get_embeddings_from_openai(input_data):
+    payload = {
+        "input": input_data,
+        "model": constants.EMBEDDING_MODEL
+    }
+
+    # timeouts, retries and connection pooling are handled by the shared client
+    with time_stage("embedding"):
+        return await openai_client.post(constants.OPENAI_API_URL_EMBEDDINGS, payload, kind=EMBEDDINGS)
+
@@ -0,0 +1,218 @@
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import components.config.constants as constants
+import components.qa_system.database_operations as db
+from components.qa_system.embedding_provider import embedding_provider
+from components.qa_system.faq_snapshot import open_snapshot, read_snapshot_version
+
+logger = logging.getLogger(__name__)
+
+# `score` ranks the matches, it combines the similarity of the query to the question and, when re-ranking, to the answer
+FAQMatch = namedtuple("FAQMatch", ["answer", "question", "score", "question_score", "answer_score"])
+
+
+def normalize_embeddings(embeddings):
+    embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(embeddings / norms)
+
+
+def top_k_indices(scores, k):
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    if k < scores.shape[-1]:
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(scores.shape[-1])
+
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+def rerank(query, questions, answers, question_scores, answer_embeddings, answer_weight, k, similarity_threshold):
+    """Second retrieval stage: re-scores the candidates of the first stage, and only them, with a weighted combination
+    of their question and answer similarities. `answer_embeddings` holds the normalized answer embeddings of the
+    candidates, or is None to rank by question similarity only.
+
+    `similarity_threshold` applies to the question similarity, answer similarities being usually much lower: the
+    combined score only orders the candidates which pass it."""
+    question_scores = np.asarray(question_scores, dtype=np.float32)
+
+    if answer_embeddings is not None and answer_weight:
+        answer_scores = np.asarray(answer_embeddings, dtype=np.float32) @ query
+        # NaN rows stand for missing answer embeddings, they are ranked by their question similarity
+        answer_scores = np.where(np.isnan(answer_scores), question_scores, answer_scores)
+        scores = (1 - answer_weight) * question_scores + answer_weight * answer_scores
+    else:
+        answer_scores = None
+        scores = question_scores
+
+    eligible_indices = np.arange(len(question_scores)) if similarity_threshold is None \
+        else np.flatnonzero(question_scores >= similarity_threshold)
+
+    return [FAQMatch(answers[index], questions[index], float(scores[index]), float(question_scores[index]),
+                     float(answer_scores[index]) if answer_scores is not None else None)
+            for index in eligible_indices[top_k_indices(scores[eligible_indices], k)]]
+
+
+class FAQIndex:
+    """Resident FAQ index: a contiguous float32 matrix of L2-normalized question embeddings plus parallel arrays of
+    questions and answers, so a query is scored with a single matrix-vector product.
+
+    With a non-zero `answer_weight`, the normalized answer embeddings are kept too, in float16 since only the rows of
+    the re-ranked candidates are ever read.
+
+    With a `snapshot_path`, the index memory-maps the snapshot published by faq_snapshot_publisher.py instead of
+    loading its own copy of the FAQ, and switches to a newer version within `snapshot_check_seconds`."""
+
+    def __init__(self, answer_weight=constants.RERANK_ANSWER_WEIGHT, snapshot_path=None,
+                 snapshot_check_seconds=constants.FAQ_INDEX_SNAPSHOT_CHECK_SECONDS):
+        self.answer_weight = answer_weight
+        self.snapshot_path = snapshot_path
+        self.snapshot_check_seconds = snapshot_check_seconds
+        self.snapshot_version = None
+        self._snapshot_checked_at = 0.0
+        self._lock = threading.Lock()
+        self._state = None
+        self._stale = True
+
+    @property
+    def is_loaded(self):
+        return self._state is not None
+
+    def __len__(self):
+        return 0 if self._state is None else len(self._state[0])
+
+    def _build_state(self, questions, answers, question_embeddings, answer_embeddings=None):
+        questions = np.asarray(questions, dtype=object)
+        answers = np.asarray(answers, dtype=object)
+
+        if len(questions):
+            question_matrix = normalize_embeddings(question_embeddings)
+        else:
+            question_matrix = np.empty((0, 0), dtype=np.float32)
+
+        answer_matrix = None
+        if self.answer_weight and answer_embeddings is not None and len(questions):
+            answer_matrix = normalize_embeddings(answer_embeddings).astype(np.float16)
+
+        return questions, answers, question_matrix, answer_matrix
+
+    def load(self, questions, answers, question_embeddings, answer_embeddings=None):
+        # swap the whole state at once, so concurrent searches never see a half-built index
+        self._state = self._build_state(questions, answers, question_embeddings, answer_embeddings)
+        self._stale = False
+
+    def reload(self):
+        with self._lock:
+            self._reload()
+
+    def _reload(self):
+        # cleared before reading, so an invalidate() racing with the read triggers another reload
+        self._stale = False
+
+        # until the first snapshot of this embedding provider is published, the FAQ is loaded from the database
+        if self.snapshot_path and os.path.exists(self.snapshot_path) and self._map_snapshot():
+            return
+
+        try:
+            with db.get_connection() as conn:
+                embeddings = db.retrieve_embeddings_from_database(conn, embedding_provider.name)
+        except Exception:
+            self._stale = True
+            raise
+
+        # a row without answer embedding is re-ranked by its question embedding only
+        self._state = self._build_state([embedding.question for embedding in embeddings],
+                                        [embedding.answer for embedding in embeddings],
+                                        [embedding.question_embedding for embedding in embeddings],
+                                        [embedding.answer_embedding if embedding.answer_embedding is not None
+                                         else embedding.question_embedding for embedding in embeddings])
+
+    def _map_snapshot(self):
+        """Maps the published snapshot; returns False, leaving the state as is, when it was built with embeddings of
+        another provider or dimension, e.g. published by a worker not yet restarted with the new configuration."""
+        try:
+            (version, embedding_provider_name, dimension, questions, answers, question_matrix,
+             answer_matrix) = open_snapshot(self.snapshot_path)
+        except Exception:
+            self._stale = True
+            raise
+
+        # recorded either way, so the snapshot is checked again only once a new version is published
+        self.snapshot_version = version
+        if embedding_provider_name != embedding_provider.name or dimension != embedding_provider.dimension:
+            logger.warning(f"Ignoring FAQ snapshot version {version} of {embedding_provider_name} ({dimension} "
+                           f"dimensions), the embeddings of {embedding_provider.name} are loaded from the database")
+            return False
+
+        # mapping is O(1) whatever the FAQ size, the searches in flight keep the previous mapping until they finish
+        self._state = questions, answers, question_matrix, answer_matrix if self.answer_weight else None
+        return True
+
+    def _check_snapshot(self):
+        now = time.monotonic()
+        if now - self._snapshot_checked_at < self.snapshot_check_seconds:
+            return
+
+        self._snapshot_checked_at = now
+        if read_snapshot_version(self.snapshot_path) not in (None, self.snapshot_version):
+            self._stale = True
+
+    def ensure_loaded(self):
+        if self.snapshot_path:
+            self._check_snapshot()
+
+        if self._stale:
+            with self._lock:
+                if self._stale:
+                    self._reload()
+
+    def invalidate(self):
+        # the current state keeps serving searches until the next ensure_loaded picks up the new rows
+        self._stale = True
+
+    def _rerank_candidates(self, query, question_scores, k, candidates, similarity_threshold):
+        questions, answers, _, answer_matrix = self._state
+
+        # first stage: the `candidates` best questions, never fewer than the `k` returned; the answers of the others
+        # are never touched
+        candidate_indices = top_k_indices(question_scores, max(k, candidates))
+
+        return rerank(query, questions[candidate_indices], answers[candidate_indices],
+                      question_scores[candidate_indices],
+                      answer_matrix[candidate_indices] if answer_matrix is not None else None,
+                      self.answer_weight, k, similarity_threshold)
+
+    def search(self, query_embedding, k=1, similarity_threshold=None, candidates=constants.RETRIEVAL_CANDIDATES):
+        """Returns up to `k` FAQMatch, best first; `candidates` is the size of the first, question-only stage, raised
+        to `k` when smaller."""
+        if self._state is None or not len(self._state[0]):
+            return []
+
+        query = normalize_embeddings(query_embedding)[0]
+        question_scores = self._state[2] @ query
+
+        return self._rerank_candidates(query, question_scores, k, candidates, similarity_threshold)
+
+    def search_batch(self, query_embeddings, k=1, similarity_threshold=None, candidates=constants.RETRIEVAL_CANDIDATES):
+        if self._state is None or not len(self._state[0]):
+            return [[] for _ in query_embeddings]
+
+        # one matrix-matrix product scores every query against every FAQ question
+        queries = normalize_embeddings(query_embeddings)
+        question_scores = queries @ self._state[2].T
+
+        return [self._rerank_candidates(query, query_question_scores, k, candidates, similarity_threshold)
+                for query, query_question_scores in zip(queries, question_scores)]
+
+
+faq_index = FAQIndex(snapshot_path=constants.FAQ_INDEX_SNAPSHOT_PATH if constants.FAQ_INDEX_SHARED else None)
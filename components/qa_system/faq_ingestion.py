@@ -0,0 +1,183 @@
+"""Bulk FAQ ingestion: streams FAQ entries from CSV (`question,answer` header) or JSON Lines files of any size, embeds
+them in large batches with the active embedding provider, several at a time, and upserts each batch in a single
+transaction.
+
+Entries whose question/answer hash is already stored, embedded by the active provider, are skipped, so an interrupted
+run resumes where it stopped and switching providers re-embeds the whole FAQ:
+
+    python -m components.qa_system.faq_ingestion faq.jsonl --concurrency 8
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import time
+
+import components.config.constants as constants
+import components.qa_system.database_operations as db
+from components.qa_system.embedding_provider import embedding_provider
+from components.qa_system.faq_index import faq_index
+from components.qa_system.faq_search import compute_content_hash
+from components.qa_system.openai_client import openai_client
+
+logger = logging.getLogger(__name__)
+
+FAQ_FILE_FORMATS = ("csv", "jsonl")
+
+
+def get_file_format(filename):
+    extension = os.path.splitext(filename)[1].lower().lstrip(".")
+    return "jsonl" if extension == "ndjson" else extension
+
+
+def read_faq_entries(faq_file, file_format):
+    """Streams the {"question": ..., "answer": ...} entries of an open CSV or JSON Lines text file."""
+    if file_format == "csv":
+        rows = csv.DictReader(faq_file)
+    elif file_format == "jsonl":
+        rows = (json.loads(line) for line in faq_file if line.strip())
+    else:
+        raise ValueError(f"Unsupported FAQ file format: {file_format}, expected one of {FAQ_FILE_FORMATS}")
+
+    for row_number, row in enumerate(rows, start=1):
+        question = (row.get("question") or "").strip()
+        answer = (row.get("answer") or "").strip()
+
+        if question and answer:
+            yield {"question": question, "answer": answer}
+        else:
+            logger.warning(f"Skipping FAQ entry {row_number}: missing question or answer")
+
+
+def estimate_tokens(text):
+    # English averages ~4 characters per token, 3 keeps the estimate on the safe side of the request limit
+    return len(text) // 3 + 1
+
+
+def batch_faq_entries(faq_entries, max_inputs, max_tokens):
+    """Packs the entries into the largest batches whose question and answer inputs fit in one embeddings request."""
+    batch = {}
+    batch_tokens = 0
+
+    for faq_entry in faq_entries:
+        entry_tokens = estimate_tokens(faq_entry["question"]) + estimate_tokens(faq_entry["answer"])
+        is_full = 2 * (len(batch) + 1) > max_inputs or batch_tokens + entry_tokens > max_tokens
+
+        if batch and is_full and faq_entry["question"] not in batch:
+            yield list(batch.values())
+            batch = {}
+            batch_tokens = 0
+
+        # a question repeated within a batch keeps its last answer, a single upsert cannot update a row twice
+        batch[faq_entry["question"]] = faq_entry
+        batch_tokens += entry_tokens
+
+    if batch:
+        yield list(batch.values())
+
+
+def retrieve_stored_hashes(provider_name):
+    with db.get_connection() as conn:
+        return db.retrieve_embedding_hashes(conn, provider_name)
+
+
+async def embed_and_store_batch(faq_entries):
+    inputs = [text for faq_entry in faq_entries for text in (faq_entry["question"], faq_entry["answer"])]
+    embeddings = await embedding_provider.embed(inputs)
+
+    rows = [(faq_entry["question"], faq_entry["answer"], embeddings[2 * index], embeddings[2 * index + 1],
+             compute_content_hash(faq_entry["question"], faq_entry["answer"]))
+            for index, faq_entry in enumerate(faq_entries)]
+
+    # the whole batch is committed at once, so a run interrupted later resumes after it
+    await asyncio.to_thread(db.insert_embeddings_batch, rows, embedding_provider=embedding_provider.name)
+    return len(rows)
+
+
+async def ingest_faq_entries(faq_entries, concurrency=constants.INGESTION_CONCURRENCY,
+                             max_inputs=constants.INGESTION_MAX_INPUTS_PER_REQUEST,
+                             max_tokens=constants.INGESTION_MAX_TOKENS_PER_REQUEST,
+                             max_input_tokens=constants.INGESTION_MAX_TOKENS_PER_INPUT):
+    """Embeds and stores the new or changed entries of the `faq_entries` iterable, with at most `concurrency`
+    batches in flight, so memory stays bounded whatever the number of entries. Entries with a question or answer
+    longer than `max_input_tokens` are skipped, since one of them would fail its whole batch."""
+    started_at = time.perf_counter()
+    stored_hashes = await asyncio.to_thread(retrieve_stored_hashes, embedding_provider.name)
+    counts = {"read": 0, "unchanged": 0, "too_long": 0, "embedded": 0}
+
+    def changed_faq_entries():
+        for faq_entry in faq_entries:
+            counts["read"] += 1
+            content_hash = compute_content_hash(faq_entry["question"], faq_entry["answer"])
+            if stored_hashes.get(faq_entry["question"]) == content_hash:
+                counts["unchanged"] += 1
+            elif max(estimate_tokens(faq_entry["question"]), estimate_tokens(faq_entry["answer"])) > max_input_tokens:
+                counts["too_long"] += 1
+                logger.warning(f"Skipping FAQ entry {faq_entry['question'][:80]!r}: its question or answer is longer "
+                               f"than {max_input_tokens} tokens")
+            else:
+                yield faq_entry
+
+    pending = set()
+
+    def collect(finished_tasks):
+        for finished_task in finished_tasks:
+            counts["embedded"] += finished_task.result()
+        logger.info(f"FAQ ingestion: {counts['read']} entries read, {counts['embedded']} embedded")
+
+    try:
+        for batch in batch_faq_entries(changed_faq_entries(), max_inputs, max_tokens):
+            if len(pending) >= concurrency:
+                finished_tasks, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                collect(finished_tasks)
+
+            pending.add(asyncio.create_task(embed_and_store_batch(batch)))
+
+        if pending:
+            finished_tasks, pending = await asyncio.wait(pending)
+            collect(finished_tasks)
+    finally:
+        for pending_task in pending:
+            pending_task.cancel()
+
+        if counts["embedded"]:
+            faq_index.invalidate()
+
+    return {**counts, "seconds": round(time.perf_counter() - started_at, 3)}
+
+
+# STEP 0 - Sync the FAQ, only (re-)embedding entries which are new or changed since the last sync
+async def sync_faq_embeddings(faq_database):
+    return (await ingest_faq_entries(faq_database))["embedded"]
+
+
+async def ingest_faq_file(path, concurrency=constants.INGESTION_CONCURRENCY):
+    with open(path, "r", encoding="utf-8", newline="") as faq_file:
+        return await ingest_faq_entries(read_faq_entries(faq_file, get_file_format(path)), concurrency=concurrency)
+
+
+async def main(path, concurrency):
+    try:
+        await embedding_provider.start()
+        result = await ingest_faq_file(path, concurrency)
+    finally:
+        await embedding_provider.stop()
+        await openai_client.close()
+        db.close_connection_pool()
+
+    print(f"{result['read']} entries read, {result['unchanged']} unchanged, {result['too_long']} too long, "
+          f"{result['embedded']} embedded in {result['seconds']}s")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="CSV file with a question,answer header or JSON Lines file")
+    parser.add_argument("--concurrency", type=int, default=constants.INGESTION_CONCURRENCY,
+                        help="embeddings requests in flight")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.path, args.concurrency))
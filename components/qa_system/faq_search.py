@@ -1,86 +1,87 @@
-import os
-
-import numpy as np
-import requests
-from openai import OpenAIError
-from scipy.spatial.distance import cosine
+import asyncio
+import hashlib
+import json
+import logging
+import time
 
 import components.config.constants as constants
-import components.qa_system.database_operations as db
 from components.exceptions.custom_exceptions import *
+from components.qa_system.answer_cache import answer_cache
+from components.qa_system.embedding_cache import query_embedding_cache
+from components.qa_system.embedding_provider import embedding_provider
+from components.qa_system.faq_index import faq_index
+from components.qa_system.metrics import STAGE_DURATION, time_stage
+from components.qa_system.openai_client import openai_client
+from components.qa_system.pgvector_index import PgVectorIndex
 
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+logger = logging.getLogger(__name__)
 
 
-# STEP 1 - Compute embeddings for FAQ questions & answers
-def compute_embeddings(conn, faq_database):
-    with conn.cursor() as cursor:
-        for faq_entry in faq_database:
-            current_question = faq_entry["question"]
-            current_answer = faq_entry["answer"]
+def compute_content_hash(question, answer):
+    return hashlib.sha256(json.dumps([question, answer]).encode("utf-8")).hexdigest()
 
-            response = get_embeddings_from_openai([current_question, current_answer])
 
-            if response.status_code == 200:
-                embeddings = response.json()["data"]
-                current_question_embedding = embeddings[0]["embedding"]
-                current_answer_embedding = embeddings[1]["embedding"]
+async def process_embeddings_for_user(user_question):
+    with time_stage("query_embedding_cache"):
+        cached_embedding = await query_embedding_cache.get(user_question, embedding_provider.name)
+    if cached_embedding is not None:
+        return cached_embedding
 
-                # TODO use a vector database such as  PG vector, Milvus or even a simple Faiss index instead of storing the string repr in PostgreSQL db
-                db.insert_into_embeddings(conn, cursor, current_question, current_answer, current_question_embedding,
-                                          current_answer_embedding)
+    user_question_embeddings = await embedding_provider.embed_query(user_question)
+    await query_embedding_cache.set(user_question, embedding_provider.name, user_question_embeddings)
+    return user_question_embeddings
 
-            else:
-                raise EmbeddingError(f"Error computing embeddings: {response.status_code}")
 
+async def process_embeddings_for_users(user_questions):
+    # a single shared-tier query and a single upsert for the whole batch, rather than one per question
+    with time_stage("query_embedding_cache"):
+        user_question_embeddings = await query_embedding_cache.get_many(user_questions, embedding_provider.name)
+    missing_indices = [index for index, embedding in enumerate(user_question_embeddings) if embedding is None]
 
-def process_embeddings_for_user(user_question):
-    response = get_embeddings_from_openai(user_question)
+    if missing_indices:
+        # all the cache misses are embedded with a single request
+        embeddings = await embedding_provider.embed([user_questions[index] for index in missing_indices])
+        for index, embedding in zip(missing_indices, embeddings):
+            user_question_embeddings[index] = embedding
 
-    if response.status_code == 200:
-        data = response.json()["data"]
-        user_question_embeddings = data[0]["embedding"]
-        return user_question_embeddings
-    else:
-        raise EmbeddingError(f"Error computing embeddings: {response.status_code}")
+        await query_embedding_cache.set_many([user_questions[index] for index in missing_indices],
+                                             embedding_provider.name, embeddings)
 
+    return user_question_embeddings
 
-# Function to compute embeddings for a given input data using OpenAI API
-def get_embeddings_from_openai(input_data):
-    payload = {
-        "input": input_data,
-        "model": constants.EMBEDDING_MODEL
-    }
-    headers = {
-        "Content-Type": constants.CONTENT_TYPE,
-        "Authorization": f"Bearer {OPENAI_API_KEY}"
-    }
 
-    try:
-        response = requests.post(constants.OPENAI_API_URL_EMBEDDINGS, json=payload, headers=headers)
-        return response
-    except requests.exceptions.RequestException as exception:
-        raise RequestError(f"Error occurred during HTTP request: {exception}")
-    except OpenAIError as exception:
-        raise OpenAIError(f"Error occurred during OpenAI API request: {exception}")
+# STEP 2 - Similarity Search
+# two-stage retrieval: the RETRIEVAL_CANDIDATES most similar FAQ questions are re-ranked by question and answer
+# similarity, only the RETRIEVAL_TOP_K best matches with a score above the similarity_threshold are returned
+def search_faq(user_query_embedding, similarity_threshold):
+    return get_faq_index().search(user_query_embedding, k=constants.RETRIEVAL_TOP_K,
+                                  similarity_threshold=similarity_threshold, candidates=constants.RETRIEVAL_CANDIDATES)
 
 
-# STEP 2 - Similarity Search
-# finds the most similar question and  compute the similarity between a user's query and the questions in the FAQ database
-def similarity_search(user_query_embedding, faq_questions, faq_questions_embeddings, faq_answers,
-                      similarity_threshold):
-    similarities = [1 - cosine(user_query_embedding, faq_question_embedding) for faq_question_embedding in
-                    faq_questions_embeddings]
-
-    # Check if any similarity scores are above the similarity_threshold
-    valid_similarity_scores = [similarity for similarity in similarities if similarity >= similarity_threshold]
-
-    if valid_similarity_scores:
-        max_similarity_index = np.argmax(similarities)
-        max_similarity_score = similarities[max_similarity_index]
-        return faq_answers[max_similarity_index], faq_questions[max_similarity_index], max_similarity_score
-    else:
-        return None, None, None
+def search_faq_batch(user_query_embeddings, similarity_threshold):
+    return get_faq_index().search_batch(user_query_embeddings, k=constants.RETRIEVAL_TOP_K,
+                                        similarity_threshold=similarity_threshold,
+                                        candidates=constants.RETRIEVAL_CANDIDATES)
+
+
+async def retrieve_matches(user_query_embedding, similarity_threshold):
+    # a pool checkout and SQL query (pgvector) or a reload of the FAQ (in-process index) can block for seconds,
+    # so the search runs on a thread instead of stalling every request of the worker
+    with time_stage("similarity_search"):
+        return await asyncio.to_thread(search_faq, user_query_embedding, similarity_threshold)
+
+
+async def retrieve_matches_batch(user_query_embeddings, similarity_threshold):
+    with time_stage("similarity_search_batch"):
+        return await asyncio.to_thread(search_faq_batch, user_query_embeddings, similarity_threshold)
+
+
+def get_faq_index():
+    if constants.EMBEDDINGS_BACKEND == "pgvector":
+        return PgVectorIndex()
+
+    faq_index.ensure_loaded()
+    return faq_index
 
 
 # STEP 3 - Interacting with OpenAI API
@@ -92,7 +93,7 @@ def decide_use_openai(similarity_score, similarity_threshold):
 
 
 # Function to interact with OpenAI API to get an answer
-def get_answer_from_openai(user_query):
+async def get_answer_from_openai(user_query):
     payload = {
         "model": constants.OPENAI_GET_ANSWER_MODEL,
         "messages": [
@@ -102,45 +103,132 @@ def get_answer_from_openai(user_query):
             }
         ]
     }
-    headers = {
-        "Content-Type": constants.CONTENT_TYPE,
-        "Authorization": f"Bearer {OPENAI_API_KEY}"
+
+    with time_stage("chat_completion"):
+        response = await openai_client.post(constants.OPENAI_API_URL_COMPLETIONS, payload)
+
+    if response.status_code == 200:
+        data = response.json()
+
+        if data.get("choices"):
+            return data["choices"][0]["message"]["content"]
+        else:
+            return "There is no response from OpenAI API."
+    else:
+        raise OpenAIError(f"Error occurred during OpenAI API request: {response.status_code}")
+
+
+# Function to stream the answer from OpenAI API, yields the content deltas as they arrive
+async def stream_answer_from_openai(user_query):
+    payload = {
+        "model": constants.OPENAI_GET_ANSWER_MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": user_query
+            }
+        ],
+        "stream": True
     }
 
-    try:
-        response = requests.post(constants.OPENAI_API_URL_COMPLETIONS, json=payload, headers=headers)
-        if response.status_code == 200:
-            data = response.json()
+    started_at = time.perf_counter()
+    is_first_token = True
 
-            if data.get("choices"):
-                return data["choices"][0]["message"]["content"]
-            else:
-                return "There is no response from OpenAI API."
-    except requests.exceptions.RequestException as exception:
-        raise RequestError(f"Error occurred during HTTP request: {exception}")
-    except OpenAIError as exception:
-        raise OpenAIError(f"Error occurred during OpenAI API request: {exception}")
+    with time_stage("chat_completion_stream"):
+        async with openai_client.stream(constants.OPENAI_API_URL_COMPLETIONS, payload) as response:
+            if response.status_code != 200:
+                raise OpenAIError(f"Error occurred during OpenAI API request: {response.status_code}")
 
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
 
-def process_user_query(conn, user_question, similarity_threshold):
-    user_question_embedding = process_embeddings_for_user(user_question)
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
 
-    embeddings = db.retrieve_embeddings_from_database(conn)
+                choices = json.loads(data).get("choices")
+                content = choices[0].get("delta", {}).get("content") if choices else None
+                if content:
+                    if is_first_token:
+                        STAGE_DURATION.labels(stage="chat_completion_first_token").observe(
+                            time.perf_counter() - started_at)
+                        is_first_token = False
+                    yield content
 
-    faq_questions = [embedding.question for embedding in embeddings]
-    faq_questions_embeddings = [embedding.question_embedding for embedding in embeddings]
-    faq_answers = [embedding.answer for embedding in embeddings]
 
-    answer_from_local_faq, question_from_local_faq, similarity_score = similarity_search(user_question_embedding,
-                                                                                         faq_questions,
-                                                                                         faq_questions_embeddings,
-                                                                                         faq_answers,
-                                                                                         similarity_threshold)
+async def find_answer_without_openai(user_question, similarity_threshold, classification=None):
+    """Answers the question from the local FAQ, the classifier verdict or the answer cache; the answer is None
+    when a chat completion is needed. Returns the source, matched question, answer, query embedding and the FAQ
+    matches, best first."""
 
-    use_openai = decide_use_openai(similarity_score, similarity_threshold)
+    # `classification` is an awaitable IT-relatedness verdict computed concurrently by the caller, when given,
+    # non-IT questions which are not in the FAQ are not sent to the (expensive) chat completion
+    user_question_embedding = await process_embeddings_for_user(user_question)
 
-    if use_openai:
-        answer_from_openai = get_answer_from_openai(user_question)
-        return "openai", "N/A", answer_from_openai
-    else:
-        return "local", question_from_local_faq, answer_from_local_faq
+    matches = await retrieve_matches(user_question_embedding, similarity_threshold)
+
+    # the matches are thresholded by question similarity, their combined score only orders them
+    use_openai = decide_use_openai(matches[0].question_score if matches else None, similarity_threshold)
+
+    if not use_openai:
+        return "local", matches[0].question, matches[0].answer, user_question_embedding, matches
+
+    source, question, answer = await find_fallback_answer_without_openai(user_question_embedding, classification)
+    return source, question, answer, user_question_embedding, matches
+
+
+async def find_fallback_answer_without_openai(user_question_embedding, classification=None):
+    if classification is not None and not await classification:
+        return "classifier", "N/A", constants.NON_IT_QUESTION_ANSWER
+
+    # paraphrases of an already answered question reuse its completion
+    with time_stage("answer_cache"):
+        cached_answer = answer_cache.get(user_question_embedding)
+    if cached_answer is not None:
+        answer_from_cache, _ = cached_answer
+        return "openai-cache", "N/A", answer_from_cache
+
+    return "openai", "N/A", None
+
+
+async def process_user_query(user_question, similarity_threshold, classification=None):
+    source, question, answer, user_question_embedding, matches = await find_answer_without_openai(
+        user_question, similarity_threshold, classification)
+
+    if answer is None:
+        answer = await get_answer_from_openai(user_question)
+        answer_cache.set(user_question_embedding, answer)
+
+    return source, question, answer, matches
+
+
+async def process_user_queries(user_questions, similarity_threshold, classification=None):
+    """Batch variant of process_user_query: one embeddings request, one matrix-matrix product against the FAQ and
+    bounded-concurrency chat completions for the fallbacks. `classification` is an awaitable list of verdicts.
+    The (source, question, answer, matches) results are in the order of `user_questions`."""
+    user_question_embeddings = await process_embeddings_for_users(user_questions)
+
+    best_matches = await retrieve_matches_batch(user_question_embeddings, similarity_threshold)
+
+    openai_semaphore = asyncio.Semaphore(constants.BATCH_OPENAI_CONCURRENCY)
+
+    async def is_it_related(index):
+        return (await classification)[index]
+
+    async def process_user_question(index):
+        matches = best_matches[index]
+        if matches:
+            return "local", matches[0].question, matches[0].answer, matches
+
+        source, question, answer = await find_fallback_answer_without_openai(
+            user_question_embeddings[index], is_it_related(index) if classification is not None else None)
+
+        if answer is None:
+            async with openai_semaphore:
+                answer = await get_answer_from_openai(user_questions[index])
+            answer_cache.set(user_question_embeddings[index], answer)
+
+        return source, question, answer, matches
+
+    return await asyncio.gather(*(process_user_question(index) for index in range(len(user_questions))))
@@ -0,0 +1,143 @@
+"""FAQ snapshot: the normalized FAQ embedding matrices and texts in one file, which every worker memory-maps read-only,
+so the FAQ is held once in the page cache whatever the number of workers.
+
+Layout, every section 64-byte aligned:
+
+    header      magic, version, rows, dimension, the offset of each section, then the name of the embedding provider
+    questions   rows x dimension float32, L2-normalized
+    answers     rows x dimension float16, L2-normalized, absent (offset 0) when not re-ranking by answer
+    offsets     2 x (rows + 1) uint64, the bounds of each question, then of each answer, in the text section
+    texts       the UTF-8 questions then answers
+
+A new version is written next to the current snapshot and renamed over it, so a snapshot is never seen half-written
+and the workers still searching the previous version keep their mapping until they switch. The provider name and
+dimension let a worker configured with another embedding provider ignore a snapshot it cannot search.
+"""
+import mmap
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+from components.exceptions.custom_exceptions import EmbeddingError
+
+SNAPSHOT_MAGIC = b"QAFAQ\x00\x00\x02"
+# magic, version, rows, dimension, the offsets of the questions, answers, offsets and texts sections, then the
+# NUL-padded UTF-8 name of the embedding provider
+SNAPSHOT_PROVIDER_NAME_SIZE = 256
+SNAPSHOT_HEADER = struct.Struct(f"<8sQQQQQQQ{SNAPSHOT_PROVIDER_NAME_SIZE}s")
+SNAPSHOT_ALIGNMENT = 64
+
+
+def align(offset):
+    return -(-offset // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+
+
+class PackedStrings:
+    """Read-only sequence over UTF-8 strings packed in a buffer, only the strings accessed are decoded."""
+
+    def __init__(self, offsets, data):
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return bytes(self._data[self._offsets[index]:self._offsets[index + 1]]).decode("utf-8")
+        return [self[int(item)] for item in index]
+
+
+def read_snapshot_version(path):
+    """Returns the version of the snapshot at `path`, or None when there is none."""
+    try:
+        with open(path, "rb") as snapshot_file:
+            magic, version = SNAPSHOT_HEADER.unpack(snapshot_file.read(SNAPSHOT_HEADER.size))[:2]
+    except (FileNotFoundError, struct.error):
+        return None
+
+    return version if magic == SNAPSHOT_MAGIC else None
+
+
+def write_snapshot(path, version, embedding_provider_name, dimension, questions, answers, question_matrix,
+                   answer_matrix=None):
+    """Atomically replaces the snapshot at `path`; the matrices must already be normalized."""
+    rows = len(questions)
+    if rows and question_matrix.shape[1] != dimension:
+        raise EmbeddingError(f"FAQ snapshot of dimension {dimension}, got embeddings of {question_matrix.shape[1]}")
+
+    encoded_provider_name = embedding_provider_name.encode("utf-8")
+    if len(encoded_provider_name) > SNAPSHOT_PROVIDER_NAME_SIZE:
+        raise EmbeddingError(f"Embedding provider name too long for the FAQ snapshot: {embedding_provider_name}")
+    encoded_texts = [text.encode("utf-8") for text in (*questions, *answers)]
+
+    text_offsets = np.zeros(2 * (rows + 1), dtype=np.uint64)
+    text_lengths = np.fromiter((len(text) for text in encoded_texts), dtype=np.uint64, count=2 * rows)
+    text_offsets[1:rows + 1] = np.cumsum(text_lengths[:rows])
+    text_offsets[rows + 1] = text_offsets[rows]
+    text_offsets[rows + 2:] = text_offsets[rows] + np.cumsum(text_lengths[rows:])
+
+    questions_offset = align(SNAPSHOT_HEADER.size)
+    answers_offset = align(questions_offset + rows * dimension * 4) if answer_matrix is not None else 0
+    offsets_offset = align((answers_offset + rows * dimension * 2) if answer_matrix is not None
+                           else questions_offset + rows * dimension * 4)
+    texts_offset = align(offsets_offset + text_offsets.nbytes)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix=".faq_snapshot.")
+
+    try:
+        with os.fdopen(file_descriptor, "wb") as snapshot_file:
+            snapshot_file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, version, rows, dimension, questions_offset,
+                                                     answers_offset, offsets_offset, texts_offset,
+                                                     encoded_provider_name))
+            sections = [(questions_offset, np.ascontiguousarray(question_matrix, dtype=np.float32)),
+                        (answers_offset, np.ascontiguousarray(answer_matrix, dtype=np.float16)
+                         if answer_matrix is not None else None),
+                        (offsets_offset, text_offsets)]
+
+            for offset, section in sections:
+                if section is not None:
+                    snapshot_file.seek(offset)
+                    snapshot_file.write(section.tobytes())
+
+            snapshot_file.seek(texts_offset)
+            snapshot_file.writelines(encoded_texts)
+
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.unlink(temporary_path)
+        raise
+
+
+def open_snapshot(path):
+    """Maps the snapshot at `path` read-only, without copying it. Returns (version, embedding_provider_name,
+    dimension, questions, answers, question_matrix, answer_matrix); the arrays keep the mapping alive after the file
+    is replaced."""
+    with open(path, "rb") as snapshot_file:
+        size = os.fstat(snapshot_file.fileno()).st_size
+        if size < SNAPSHOT_HEADER.size:
+            raise EmbeddingError(f"Truncated FAQ snapshot: {path}")
+        buffer = mmap.mmap(snapshot_file.fileno(), size, access=mmap.ACCESS_READ)
+
+    (magic, version, rows, dimension, questions_offset, answers_offset, offsets_offset, texts_offset,
+     encoded_provider_name) = SNAPSHOT_HEADER.unpack_from(buffer)
+    if magic != SNAPSHOT_MAGIC:
+        raise EmbeddingError(f"Not a FAQ snapshot: {path}")
+
+    question_matrix = np.frombuffer(buffer, dtype=np.float32, count=rows * dimension,
+                                    offset=questions_offset).reshape(rows, dimension)
+    answer_matrix = np.frombuffer(buffer, dtype=np.float16, count=rows * dimension,
+                                  offset=answers_offset).reshape(rows, dimension) if answers_offset else None
+
+    text_offsets = np.frombuffer(buffer, dtype=np.uint64, count=2 * (rows + 1), offset=offsets_offset)
+    texts = memoryview(buffer)[texts_offset:]
+
+    return (version, encoded_provider_name.rstrip(b"\x00").decode("utf-8"), dimension,
+            PackedStrings(text_offsets[:rows + 1], texts), PackedStrings(text_offsets[rows + 1:], texts),
+            question_matrix, answer_matrix)
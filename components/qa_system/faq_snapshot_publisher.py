@@ -0,0 +1,124 @@
+import asyncio
+import fcntl
+import logging
+import os
+
+import numpy as np
+import psycopg2
+
+import components.config.constants as constants
+import components.qa_system.database_operations as db
+from components.qa_system.embedding_provider import embedding_provider
+from components.qa_system.faq_index import normalize_embeddings
+from components.qa_system.faq_snapshot import read_snapshot_version, write_snapshot
+from components.qa_system.metrics import time_stage
+
+logger = logging.getLogger(__name__)
+
+
+class FAQSnapshotPublisher:
+    """Keeps the FAQ snapshot of the workers up to date. Every worker runs one, the one holding the lock file next to
+    the snapshot publishes it at startup and again whenever PostgreSQL notifies a change of the `embeddings` table;
+    when that worker exits, its lock is released and another worker takes over."""
+
+    def __init__(self, snapshot_path, answer_weight=constants.RERANK_ANSWER_WEIGHT,
+                 publish_delay_seconds=constants.FAQ_INDEX_PUBLISH_DELAY_SECONDS,
+                 election_seconds=constants.FAQ_INDEX_PUBLISHER_ELECTION_SECONDS):
+        self.snapshot_path = snapshot_path
+        self.answer_weight = answer_weight
+        self.publish_delay_seconds = publish_delay_seconds
+        self.election_seconds = election_seconds
+        self._lock_file = None
+
+    @property
+    def is_publisher(self):
+        return self._lock_file is not None
+
+    def try_become_publisher(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.snapshot_path)), exist_ok=True)
+        lock_file = open(f"{self.snapshot_path}.lock", "a")
+
+        try:
+            # released by the kernel when the process exits, however it exits
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+
+        self._lock_file = lock_file
+        return True
+
+    def publish(self):
+        with time_stage("faq_snapshot_publish"):
+            with db.get_connection() as conn:
+                embeddings = db.retrieve_embeddings_from_database(conn, embedding_provider.name)
+
+            question_matrix = normalize_embeddings([embedding.question_embedding for embedding in embeddings]) \
+                if embeddings else np.empty((0, 0), dtype=np.float32)
+            answer_matrix = None
+            if self.answer_weight and embeddings:
+                # a row without answer embedding is re-ranked by its question embedding only
+                answer_matrix = normalize_embeddings([embedding.answer_embedding
+                                                      if embedding.answer_embedding is not None
+                                                      else embedding.question_embedding
+                                                      for embedding in embeddings]).astype(np.float16)
+
+            version = (read_snapshot_version(self.snapshot_path) or 0) + 1
+            write_snapshot(self.snapshot_path, version, embedding_provider.name, embedding_provider.dimension,
+                           [embedding.question for embedding in embeddings],
+                           [embedding.answer for embedding in embeddings], question_matrix, answer_matrix)
+
+        logger.info(f"Published FAQ snapshot version {version}: {len(embeddings)} entries")
+        return version
+
+    async def run(self):
+        while True:
+            if not self.is_publisher and not self.try_become_publisher():
+                await asyncio.sleep(self.election_seconds)
+                continue
+
+            try:
+                await self._publish_on_changes()
+            except Exception as exception:
+                logger.warning(f"Error publishing the FAQ snapshot: {exception}")
+                await asyncio.sleep(self.election_seconds)
+
+    async def _publish_on_changes(self):
+        conn = await asyncio.to_thread(db.open_notification_connection, constants.LISTEN_FAQ_EMBEDDINGS_CHANGED_QUERY)
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        errors = []
+
+        def on_notification():
+            try:
+                conn.poll()
+            except psycopg2.Error as exception:
+                errors.append(exception)
+            conn.notifies.clear()
+            changed.set()
+
+        loop.add_reader(conn.fileno(), on_notification)
+        try:
+            # published once listening, so the changes committed in the meantime are not missed
+            await asyncio.to_thread(self.publish)
+
+            while True:
+                await changed.wait()
+                if errors:
+                    raise errors[0]
+
+                # the statements of a bulk ingestion are coalesced into one new version
+                await asyncio.sleep(self.publish_delay_seconds)
+                changed.clear()
+                await asyncio.to_thread(self.publish)
+        finally:
+            loop.remove_reader(conn.fileno())
+            conn.close()
+
+    def close(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+faq_snapshot_publisher = FAQSnapshotPublisher(constants.FAQ_INDEX_SNAPSHOT_PATH)
@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+from huggingface_hub import hf_hub_download
+from transformers import AutoConfig, AutoTokenizer
+
+import components.config.constants as constants
+
+
+def mean_pooling(token_embeddings, attention_mask):
+    # the average of the token embeddings, padding excluded, L2-normalized, as computed by sentence-transformers
+    mask = attention_mask[..., np.newaxis].astype(np.float32)
+    sentence_embeddings = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+    return sentence_embeddings / np.maximum(np.linalg.norm(sentence_embeddings, axis=1, keepdims=True), 1e-12)
+
+
+class LocalEmbeddingModel:
+    """Sentence-embedding model running on the CPU of the worker. `forward` maps the tokenized inputs (NumPy arrays)
+    to the token embeddings, through PyTorch or ONNX Runtime."""
+
+    def __init__(self, tokenizer, forward, dimension, max_length=constants.LOCAL_EMBEDDING_MAX_LENGTH):
+        self.tokenizer = tokenizer
+        self.forward = forward
+        self.dimension = dimension
+        self.max_length = max_length
+
+    def encode(self, texts, batch_size=constants.LOCAL_EMBEDDING_BATCH_SIZE):
+        """Returns the (len(texts), dimension) float32 matrix of the normalized embeddings. Texts are sorted by length
+        before batching, so each batch is padded to the longest of similar-length texts."""
+        order = sorted(range(len(texts)), key=lambda index: len(texts[index]))
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+
+        for start in range(0, len(order), batch_size):
+            batch_indices = order[start:start + batch_size]
+            encoded_inputs = self.tokenizer([texts[index] for index in batch_indices], padding=True, truncation=True,
+                                            max_length=self.max_length, return_tensors="np")
+            embeddings[batch_indices] = mean_pooling(self.forward(encoded_inputs), encoded_inputs["attention_mask"])
+
+        return embeddings
+
+
+def load_onnx_forward(model_path, onnx_file, threads):
+    # onnxruntime is only needed by the workers serving the ONNX backend
+    import onnxruntime
+
+    if os.path.isdir(model_path):
+        onnx_model_path = os.path.join(model_path, onnx_file)
+    else:
+        onnx_model_path = hf_hub_download(model_path, onnx_file)
+
+    session_options = onnxruntime.SessionOptions()
+    session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads:
+        session_options.intra_op_num_threads = threads
+
+    session = onnxruntime.InferenceSession(onnx_model_path, sess_options=session_options,
+                                           providers=["CPUExecutionProvider"])
+    input_names = {session_input.name for session_input in session.get_inputs()}
+
+    def forward(encoded_inputs):
+        # the first output holds the token embeddings (last_hidden_state)
+        return session.run(None, {name: value.astype(np.int64) for name, value in encoded_inputs.items()
+                                  if name in input_names})[0]
+
+    return forward
+
+
+def load_pytorch_forward(model_path):
+    # imported here, so the workers serving the ONNX backend never load torch
+    import torch
+    from transformers import AutoModel
+
+    model = AutoModel.from_pretrained(model_path)
+    model.eval()
+
+    def forward(encoded_inputs):
+        with torch.inference_mode():
+            return model(**{name: torch.from_numpy(value) for name, value in encoded_inputs.items()}) \
+                .last_hidden_state.numpy()
+
+    return forward
+
+
+def load_local_embedding_model(model_path=constants.LOCAL_EMBEDDING_MODEL, backend=constants.LOCAL_EMBEDDING_BACKEND,
+                               onnx_file=constants.LOCAL_EMBEDDING_ONNX_FILE,
+                               threads=constants.LOCAL_EMBEDDING_THREADS):
+    if backend == "onnx":
+        forward = load_onnx_forward(model_path, onnx_file, threads)
+    elif backend == "pytorch":
+        forward = load_pytorch_forward(model_path)
+    else:
+        raise ValueError(f"Unsupported local embedding backend: {backend}, expected 'pytorch' or 'onnx'")
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    config = AutoConfig.from_pretrained(model_path)
+
+    local_embedding_model = LocalEmbeddingModel(tokenizer, forward, config.hidden_size)
+    # the first forward pass allocates the buffers of the model, it is not left to the first question
+    local_embedding_model.encode([constants.CLASSIFIER_WARM_UP_QUESTION])
+    return local_embedding_model
@@ -0,0 +1,61 @@
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+def render_metrics():
+    """Renders the metrics in the Prometheus text exposition format. Under gunicorn (PROMETHEUS_MULTIPROC_DIR set by
+    components/config/gunicorn.conf.py) the values of all the workers are aggregated, whichever worker is scraped."""
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return generate_latest(REGISTRY)
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+def snapshot(metric):
+    """Values of `metric` in this process, as plain data: `{"value"}` for a counter, `{"count", "sum", "buckets"}`
+    for a histogram, and for a metric with label names a list of those with their `labels`."""
+    children = {}
+    for family in metric.collect():
+        for sample in family.samples:
+            labels = {name: value for name, value in sample.labels.items() if name != "le"}
+            child = children.setdefault(tuple(sorted(labels.items())), {"labels": labels})
+
+            suffix = sample.name[len(family.name):]
+            if suffix == "_total":
+                child["value"] = sample.value
+            elif suffix in ("_count", "_sum"):
+                child[suffix[1:]] = sample.value
+            elif suffix == "_bucket":
+                child.setdefault("buckets", {})[sample.labels["le"]] = sample.value
+
+    if list(children) == [()]:
+        children[()].pop("labels")
+        return children[()]
+
+    return list(children.values())
+
+
+STAGE_DURATION = Histogram("qa_stage_duration_seconds", "Duration of the stages of question answering",
+                           labelnames=("stage",), buckets=LATENCY_BUCKETS)
+ANSWER_SOURCES = Counter("qa_answers_total", "Answers returned, by source", labelnames=("source",))
+UPSTREAM_ERRORS = Counter("qa_upstream_errors_total", "Errors of the upstream services (OpenAI, PostgreSQL)",
+                          labelnames=("upstream", "reason"))
+
+
+@contextmanager
+def time_stage(stage):
+    """Observes the duration of the enclosed block in `qa_stage_duration_seconds`, also when it raises; usable in
+    async code around awaits, e.g. `with time_stage("chat_completion"): await ...`."""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.labels(stage=stage).observe(time.perf_counter() - started_at)
@@ -0,0 +1,125 @@
+import logging
+import threading
+from datetime import datetime
+
+import components.config.constants as constants
+from components.exceptions.custom_exceptions import ModelNotLoadedError, ModelReloadInProgressError
+from components.qa_system.batching import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+
+def load_model_and_tokenizer(model_path, revision=None, token=None, backend=constants.CLASSIFIER_BACKEND):
+    if backend == "onnx":
+        from components.qa_system.onnx_classifier import load_onnx_classifier
+        return load_onnx_classifier(model_path, revision=revision, token=token)
+
+    # imported here, so the workers serving the ONNX backend never load torch
+    from transformers import BertTokenizerFast, BertForSequenceClassification, pipeline
+
+    bert = BertForSequenceClassification.from_pretrained(model_path, revision=revision, token=token)
+    tokenizer = BertTokenizerFast.from_pretrained(model_path, revision=revision, token=token)
+    binary_classifier = pipeline("text-classification", model=bert, tokenizer=tokenizer)
+    return binary_classifier
+
+
+class ModelRegistry:
+    """Holds the IT-relatedness classifier of this worker, loaded once and shared by all requests."""
+
+    def __init__(self, model_path, revision=None, token=None, backend=constants.CLASSIFIER_BACKEND,
+                 load_on_first_use=not constants.CLASSIFIER_LOAD_ON_STARTUP):
+        self.model_path = model_path
+        self.revision = revision
+        self.token = token
+        self.backend = backend
+        self.load_on_first_use = load_on_first_use
+        self.loaded_at = None
+        self._binary_classifier = None
+        self._lock = threading.Lock()
+        self._first_use_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    @property
+    def is_loaded(self):
+        return self._binary_classifier is not None
+
+    def load(self, revision=None, warm_up=True):
+        # `warm_up=False` only loads the weights, e.g. in a process which forks the workers running the inference
+        with self._lock:
+            revision = revision or self.revision
+            binary_classifier = load_model_and_tokenizer(self.model_path, revision=revision, token=self.token,
+                                                         backend=self.backend)
+            if warm_up:
+                self.warm_up(binary_classifier)
+
+            # the previous classifier keeps serving requests until the new one is loaded and warmed up
+            self._binary_classifier = binary_classifier
+            self.revision = revision
+            self.loaded_at = datetime.utcnow()
+
+        logger.info(f"Loaded {self.backend} classifier {self.model_path} (revision: {revision or 'default'})")
+
+    def reload(self, revision=None):
+        # a reload holds a second full model in memory until the swap, so reloads are never queued behind each other
+        if not self._reload_lock.acquire(blocking=False):
+            raise ModelReloadInProgressError("The IT-relatedness classifier is already being reloaded")
+
+        try:
+            self.load(revision)
+        finally:
+            self._reload_lock.release()
+
+    @staticmethod
+    def warm_up(binary_classifier):
+        binary_classifier(constants.CLASSIFIER_WARM_UP_QUESTION)
+
+    def get_classifier(self):
+        if self._binary_classifier is None and self.load_on_first_use:
+            self._load_on_first_use()
+
+        if self._binary_classifier is None:
+            raise ModelNotLoadedError("The IT-relatedness classifier is not loaded")
+        return self._binary_classifier
+
+    def _load_on_first_use(self):
+        with self._first_use_lock:
+            # the requests which waited for the first load do not load the classifier again
+            if self._binary_classifier is not None:
+                return
+
+            try:
+                self.load()
+            except Exception as exception:
+                raise ModelNotLoadedError(f"Error loading the IT-relatedness classifier: {exception}")
+
+    def status(self):
+        return {
+            "model_loaded": self.is_loaded,
+            "load_on_first_use": self.load_on_first_use,
+            "model_path": self.model_path,
+            "backend": self.backend,
+            "revision": self.revision,
+            "loaded_at": self.loaded_at.isoformat() if self.loaded_at else None
+        }
+
+
+model_registry = ModelRegistry(constants.HF_MODEL_REPO_NAME, revision=constants.HF_MODEL_REVISION,
+                               token=constants.HF_TOKEN)
+
+
+def perform_batch_binary_text_classification(user_questions, binary_classifier):
+    # a single padded forward pass over the whole batch
+    binary_classifier_results = binary_classifier([user_question.strip() for user_question in user_questions],
+                                                  batch_size=len(user_questions), truncation=True)
+
+    return [constants.CLASSIFIER_LABEL_MAPPING[binary_classifier_result["label"]] == 1
+            for binary_classifier_result in binary_classifier_results]
+
+
+def classify_it_related_questions(user_questions):
+    return perform_batch_binary_text_classification(user_questions, model_registry.get_classifier())
+
+
+classifier_batcher = MicroBatcher("classifier", classify_it_related_questions,
+                                  max_batch_size=constants.CLASSIFIER_MAX_BATCH_SIZE,
+                                  max_wait_ms=constants.CLASSIFIER_MAX_WAIT_MS)
@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+from huggingface_hub import hf_hub_download
+from transformers import AutoConfig, BertTokenizerFast
+
+import components.config.constants as constants
+
+
+class OnnxTextClassifier:
+    """Runs the classifier exported by components/transformers/bert/export_onnx_model.py with ONNX Runtime on the
+    CPU. Callable like the transformers text-classification pipeline, so it is a drop-in replacement for it."""
+
+    def __init__(self, session, tokenizer, id2label):
+        self.session = session
+        self.tokenizer = tokenizer
+        self.id2label = id2label
+        self.input_names = {session_input.name for session_input in session.get_inputs()}
+
+    def __call__(self, inputs, batch_size=None, truncation=True):
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs)
+
+        # padded to the longest question of the batch rather than to a fixed length
+        encoded_inputs = self.tokenizer(inputs, padding=True, truncation=truncation, return_tensors="np")
+        (logits,) = self.session.run(["logits"], {name: value.astype(np.int64)
+                                                  for name, value in encoded_inputs.items()
+                                                  if name in self.input_names})
+
+        exp_logits = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probabilities = exp_logits / exp_logits.sum(axis=1, keepdims=True)
+        predicted_ids = probabilities.argmax(axis=1)
+
+        return [{"label": self.id2label[int(predicted_id)], "score": float(probabilities[index, predicted_id])}
+                for index, predicted_id in enumerate(predicted_ids)]
+
+
+def load_onnx_classifier(model_path, revision=None, token=None, onnx_file=constants.CLASSIFIER_ONNX_FILE):
+    # onnxruntime is only needed by the workers serving the ONNX backend
+    import onnxruntime
+
+    if os.path.isdir(model_path):
+        onnx_model_path = os.path.join(model_path, onnx_file)
+    else:
+        onnx_model_path = hf_hub_download(model_path, onnx_file, revision=revision, token=token)
+
+    session_options = onnxruntime.SessionOptions()
+    session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if constants.CLASSIFIER_ONNX_THREADS:
+        session_options.intra_op_num_threads = constants.CLASSIFIER_ONNX_THREADS
+
+    session = onnxruntime.InferenceSession(onnx_model_path, sess_options=session_options,
+                                           providers=["CPUExecutionProvider"])
+    tokenizer = BertTokenizerFast.from_pretrained(model_path, revision=revision, token=token)
+    config = AutoConfig.from_pretrained(model_path, revision=revision, token=token)
+
+    return OnnxTextClassifier(session, tokenizer, config.id2label)
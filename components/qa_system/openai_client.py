@@ -0,0 +1,148 @@
+import asyncio
+import datetime
+import email.utils
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+
+import components.config.constants as constants
+from components.exceptions.custom_exceptions import RequestError
+from components.qa_system.metrics import UPSTREAM_ERRORS
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+# the request was never sent, so retrying it cannot make the server process it twice
+CONNECT_PHASE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+EMBEDDINGS = "embeddings"
+COMPLETIONS = "completions"
+
+
+def parse_retry_after(response):
+    """Returns the delay in seconds requested by the `retry-after-ms` / `Retry-After` headers, if any."""
+    retry_after_ms = response.headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = response.headers.get("retry-after")
+    if not retry_after:
+        return None
+
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+
+    # an HTTP date without zone is GMT, a naive datetime would otherwise be taken as local time
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class AsyncOpenAIClient:
+    """Async HTTP client for the OpenAI API: pooled keep-alive connections per worker, per-call timeouts, a cap on
+    in-flight requests and exponential backoff with jitter on 429/5xx, honoring `Retry-After`.
+
+    Embeddings and chat completions each get their own connection pool and in-flight limit. Embedding requests are
+    idempotent and retried on any transport error, completion requests only when they were never sent."""
+
+    def __init__(self, api_key, timeout=constants.OPENAI_TIMEOUT_SECONDS,
+                 connect_timeout=constants.OPENAI_CONNECT_TIMEOUT_SECONDS,
+                 max_connections=constants.OPENAI_MAX_CONNECTIONS,
+                 embeddings_max_concurrency=constants.OPENAI_EMBEDDINGS_MAX_CONCURRENCY,
+                 completions_max_concurrency=constants.OPENAI_COMPLETIONS_MAX_CONCURRENCY,
+                 max_retries=constants.OPENAI_MAX_RETRIES,
+                 backoff_base=constants.OPENAI_BACKOFF_BASE_SECONDS,
+                 backoff_max=constants.OPENAI_BACKOFF_MAX_SECONDS,
+                 transport=None):
+        self.api_key = api_key
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.transport = transport
+        self._semaphores = {EMBEDDINGS: asyncio.Semaphore(embeddings_max_concurrency),
+                            COMPLETIONS: asyncio.Semaphore(completions_max_concurrency)}
+        self._clients = {}
+
+    def _get_client(self, kind):
+        client = self._clients.get(kind)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits, transport=self.transport,
+                                       headers={"Content-Type": constants.CONTENT_TYPE,
+                                                "Authorization": f"Bearer {self.api_key}"})
+            self._clients[kind] = client
+        return client
+
+    def _backoff_delay(self, attempt, response=None):
+        retry_after = parse_retry_after(response) if response is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+
+        return min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    async def _send_with_retries(self, kind, url, payload, timeout, stream):
+        client = self._get_client(kind)
+        retryable_errors = httpx.TransportError if kind == EMBEDDINGS else CONNECT_PHASE_ERRORS
+
+        for attempt in range(self.max_retries + 1):
+            is_last_attempt = attempt == self.max_retries
+
+            try:
+                request = client.build_request("POST", url, json=payload, timeout=timeout or self.timeout)
+                response = await client.send(request, stream=stream)
+            except httpx.TransportError as exception:
+                UPSTREAM_ERRORS.labels(upstream="openai", reason=type(exception).__name__).inc()
+                # e.g. a read timeout of a completion, which the server may have processed, and billed, anyway
+                if is_last_attempt or not isinstance(exception, retryable_errors):
+                    raise RequestError(f"Error occurred during HTTP request: {exception}")
+                delay = self._backoff_delay(attempt)
+                logger.warning(f"Request to {url} failed ({exception!r}), retrying in {delay:.2f}s")
+            else:
+                if response.status_code >= 400:
+                    UPSTREAM_ERRORS.labels(upstream="openai", reason=response.status_code).inc()
+                if response.status_code not in RETRYABLE_STATUS_CODES or is_last_attempt:
+                    return response
+                # released before the backoff, so the connection goes back to the pool while sleeping
+                await response.aclose()
+                delay = self._backoff_delay(attempt, response)
+                logger.warning(f"Request to {url} returned {response.status_code}, retrying in {delay:.2f}s")
+
+            await asyncio.sleep(delay)
+
+    async def post(self, url, payload, timeout=None, kind=COMPLETIONS):
+        async with self._semaphores[kind]:
+            return await self._send_with_retries(kind, url, payload, timeout, stream=False)
+
+    @asynccontextmanager
+    async def stream(self, url, payload, timeout=None, kind=COMPLETIONS):
+        """Streams the response body, only the request itself is retried: once the response is returned to the
+        caller nothing is replayed. Leaving the context (e.g. on cancellation) closes the upstream connection."""
+        # the in-flight limit only covers the request, a long stream does not hold a permit while it is read
+        async with self._semaphores[kind]:
+            response = await self._send_with_retries(kind, url, payload, timeout, stream=True)
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    async def close(self):
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+
+openai_client = AsyncOpenAIClient(constants.OPENAI_API_KEY)
@@ -0,0 +1,49 @@
+import numpy as np
+
+import components.config.constants as constants
+import components.qa_system.database_operations as db
+from components.qa_system.embedding_provider import embedding_provider
+from components.qa_system.faq_index import FAQMatch, normalize_embeddings, rerank
+
+
+class PgVectorIndex:
+    """FAQ index backed by the pgvector `question_vector` column, the nearest-neighbour search and the similarity
+    threshold are both evaluated by PostgreSQL, so only the hits are shipped back.
+
+    With a non-zero `answer_weight`, PostgreSQL returns the nearest `candidates` questions with their answer
+    embedding instead, and they are re-ranked, and thresholded, in-process."""
+
+    def __init__(self, answer_weight=constants.RERANK_ANSWER_WEIGHT):
+        self.answer_weight = answer_weight
+
+    def _search(self, conn, query_embedding, k, similarity_threshold, candidates):
+        query_embedding = [float(value) for value in query_embedding]
+
+        if not self.answer_weight:
+            return [FAQMatch(answer, question, similarity, similarity, None)
+                    for answer, question, similarity in db.search_embeddings_pgvector(conn, query_embedding,
+                                                                                       similarity_threshold, k,
+                                                                                       embedding_provider.name)]
+
+        # the `candidates` nearest questions, never fewer than the `k` returned
+        rows = db.search_candidates_pgvector(conn, query_embedding, max(k, candidates), embedding_provider.name)
+        if not rows:
+            return []
+
+        answers, questions, question_scores, answer_embeddings = zip(*rows)
+        missing_answer_embedding = np.full(len(query_embedding), np.nan, dtype=np.float32)
+        answer_matrix = normalize_embeddings([answer_embedding if answer_embedding is not None
+                                              else missing_answer_embedding for answer_embedding in answer_embeddings])
+
+        return rerank(normalize_embeddings(query_embedding)[0], questions, answers, question_scores, answer_matrix,
+                      self.answer_weight, k, similarity_threshold)
+
+    def search(self, query_embedding, k=1, similarity_threshold=-1.0, candidates=constants.RETRIEVAL_CANDIDATES):
+        with db.get_connection() as conn:
+            return self._search(conn, query_embedding, k, similarity_threshold, candidates)
+
+    def search_batch(self, query_embeddings, k=1, similarity_threshold=-1.0,
+                     candidates=constants.RETRIEVAL_CANDIDATES):
+        with db.get_connection() as conn:
+            return [self._search(conn, query_embedding, k, similarity_threshold, candidates)
+                    for query_embedding in query_embeddings]
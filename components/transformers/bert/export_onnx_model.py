@@ -0,0 +1,108 @@
+import os
+import sys
+import time
+
+import numpy as np
+import onnxruntime
+import torch
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from transformers import BertTokenizerFast, BertForSequenceClassification, pipeline
+
+ONNX_OPSET_VERSION = 14
+# share of the inference questions on which the quantized model must predict the same label as the PyTorch one
+MIN_LABEL_AGREEMENT = 0.98
+
+
+def export_to_onnx(model_dir, onnx_model_path):
+    tokenizer = BertTokenizerFast.from_pretrained(model_dir)
+    bert = BertForSequenceClassification.from_pretrained(model_dir)
+    bert.eval()
+
+    sample_inputs = tokenizer(["How do I reset my password?", "What is the capital of France?"], padding=True,
+                              return_tensors="pt")
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+
+    # batch size and sequence length stay dynamic, so the serving side can pad each batch to its longest question
+    with torch.no_grad():
+        torch.onnx.export(bert, tuple(sample_inputs[input_name] for input_name in input_names), onnx_model_path,
+                          input_names=input_names, output_names=["logits"],
+                          dynamic_axes={**{input_name: {0: "batch", 1: "sequence"} for input_name in input_names},
+                                        "logits": {0: "batch"}},
+                          opset_version=ONNX_OPSET_VERSION, do_constant_folding=True)
+
+
+def quantize_onnx_model(onnx_model_path, quantized_model_path):
+    # dynamic quantization: int8 weights, activations quantized on the fly, no calibration dataset needed
+    quantize_dynamic(onnx_model_path, quantized_model_path, weight_type=QuantType.QInt8)
+
+
+def read_inference_questions(input_file):
+    with open(input_file, "r") as input_file:
+        next(input_file)
+        # some lines are quoted and end with a comma, the others are bare questions
+        return [line.strip().rstrip(",").strip('"') for line in input_file if line.strip()]
+
+
+def predict_with_pytorch(model_dir, questions):
+    tokenizer = BertTokenizerFast.from_pretrained(model_dir)
+    bert = BertForSequenceClassification.from_pretrained(model_dir)
+    binary_classifier = pipeline("text-classification", model=bert, tokenizer=tokenizer, top_k=None)
+
+    started_at = time.perf_counter()
+    results = binary_classifier(questions, batch_size=len(questions), truncation=True)
+    elapsed = time.perf_counter() - started_at
+    label2id = bert.config.label2id
+
+    # the scores of each question, in the order of the logits
+    probabilities = np.array([[score["score"] for score in sorted(result, key=lambda score: label2id[score["label"]])]
+                              for result in results])
+    return probabilities, elapsed
+
+
+def predict_with_onnx(model_dir, onnx_model_path, questions):
+    tokenizer = BertTokenizerFast.from_pretrained(model_dir)
+    session = onnxruntime.InferenceSession(onnx_model_path, providers=["CPUExecutionProvider"])
+    input_names = {session_input.name for session_input in session.get_inputs()}
+
+    started_at = time.perf_counter()
+    inputs = tokenizer(questions, padding=True, truncation=True, return_tensors="np")
+    (logits,) = session.run(["logits"], {name: value.astype(np.int64) for name, value in inputs.items()
+                                         if name in input_names})
+    elapsed = time.perf_counter() - started_at
+
+    exp_logits = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp_logits / exp_logits.sum(axis=1, keepdims=True), elapsed
+
+
+def check_accuracy(model_dir, onnx_model_path, input_file):
+    questions = read_inference_questions(input_file)
+
+    pytorch_probabilities, pytorch_seconds = predict_with_pytorch(model_dir, questions)
+    onnx_probabilities, onnx_seconds = predict_with_onnx(model_dir, onnx_model_path, questions)
+
+    label_agreement = float(np.mean(pytorch_probabilities.argmax(axis=1) == onnx_probabilities.argmax(axis=1)))
+    max_probability_difference = float(np.max(np.abs(pytorch_probabilities - onnx_probabilities)))
+
+    print(f"{os.path.basename(onnx_model_path)}: label agreement {label_agreement:.2%}, "
+          f"max probability difference {max_probability_difference:.4f}, "
+          f"{len(questions)} questions in {onnx_seconds:.3f}s (PyTorch: {pytorch_seconds:.3f}s)")
+
+    return label_agreement
+
+
+if __name__ == "__main__":
+    seq_trained_model_dir = "output_seq_model"
+    onnx_model_dir = os.path.join(seq_trained_model_dir, "onnx")
+    onnx_model_path = os.path.join(onnx_model_dir, "model.onnx")
+    quantized_model_path = os.path.join(onnx_model_dir, "model_quantized.onnx")
+
+    input_file = "../datasets/inference_questions.csv"
+
+    os.makedirs(onnx_model_dir, exist_ok=True)
+    export_to_onnx(seq_trained_model_dir, onnx_model_path)
+    quantize_onnx_model(onnx_model_path, quantized_model_path)
+
+    check_accuracy(seq_trained_model_dir, onnx_model_path, input_file)
+    if check_accuracy(seq_trained_model_dir, quantized_model_path, input_file) < MIN_LABEL_AGREEMENT:
+        sys.exit(f"The quantized model disagrees with the PyTorch one on more than {1 - MIN_LABEL_AGREEMENT:.0%} "
+                 f"of the inference questions")
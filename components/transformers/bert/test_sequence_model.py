@@ -1,3 +1,13 @@
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import torch
 from transformers import BertTokenizerFast, BertForSequenceClassification, pipeline
 
 
@@ -24,11 +34,154 @@ def perform_binary_text_classification(input_file, output_file, binary_classifie
                     output_file.write(f"Confidence: {binary_classifier_result['score']}\n\n")
 
 
+# Bulk inference: the input is streamed in chunks, so memory stays flat whatever its size
+def read_question_chunks(input_file, chunk_size):
+    with open(input_file, "r", newline="") as input_file:
+        rows = csv.reader(input_file)
+        next(rows)
+
+        questions = (row[0].strip() for row in rows if row and row[0].strip())
+        while chunk := list(itertools.islice(questions, chunk_size)):
+            yield chunk
+
+
+def classify_questions(questions, bert, tokenizer, batch_size, max_length=128):
+    """Returns the (label, confidence) of each question. Questions are sorted by token length before batching, so
+    each batch is padded to the longest of similar-length questions instead of to the longest of the chunk."""
+    encoded_questions = tokenizer(questions, truncation=True, max_length=max_length)["input_ids"]
+    order = sorted(range(len(questions)), key=lambda index: len(encoded_questions[index]))
+    predictions = [None] * len(questions)
+
+    with torch.inference_mode():
+        for start in range(0, len(order), batch_size):
+            batch_indices = order[start:start + batch_size]
+            batch = tokenizer.pad({"input_ids": [encoded_questions[index] for index in batch_indices]},
+                                  return_tensors="pt")
+
+            probabilities = torch.softmax(bert(**batch).logits, dim=-1)
+            confidences, labels = probabilities.max(dim=-1)
+
+            for index, label, confidence in zip(batch_indices, labels.tolist(), confidences.tolist()):
+                predictions[index] = (label, confidence)
+
+    return predictions
+
+
+_worker_model = None
+
+
+def init_worker(model_dir, num_threads):
+    global _worker_model
+
+    # each worker gets its share of the cores, instead of every worker spawning one thread per core
+    torch.set_num_threads(num_threads)
+    bert = BertForSequenceClassification.from_pretrained(model_dir)
+    bert.eval()
+    _worker_model = (bert, BertTokenizerFast.from_pretrained(model_dir))
+
+
+def classify_chunk_in_worker(questions, batch_size):
+    bert, tokenizer = _worker_model
+    return questions, classify_questions(questions, bert, tokenizer, batch_size)
+
+
+def classify_chunks(chunks, model_dir, batch_size, workers):
+    """Yields (questions, predictions) per chunk, in the input order."""
+    if workers <= 1:
+        init_worker(model_dir, torch.get_num_threads())
+        for questions in chunks:
+            yield classify_chunk_in_worker(questions, batch_size)
+        return
+
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=init_worker, initargs=(model_dir, num_threads)) as executor:
+        # at most two chunks per worker are in flight, so the input is never read ahead of the workers
+        pending = deque()
+        for questions in chunks:
+            pending.append(executor.submit(classify_chunk_in_worker, questions, batch_size))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+class PredictionWriter:
+    """Appends the predictions chunk by chunk to a CSV file, or to a Parquet file (one row group per chunk)."""
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.is_parquet = output_file.endswith(".parquet")
+        self._file = None
+        self._writer = None
+
+    def __enter__(self):
+        if not self.is_parquet:
+            self._file = open(self.output_file, "w", newline="")
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(["question", "label", "confidence"])
+        return self
+
+    def write(self, questions, predictions):
+        if not self.is_parquet:
+            self._writer.writerows((question, label, confidence)
+                                   for question, (label, confidence) in zip(questions, predictions))
+            return
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.table({"question": questions,
+                          "label": [label for label, _ in predictions],
+                          "confidence": [confidence for _, confidence in predictions]})
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.output_file, table.schema)
+        self._writer.write_table(table)
+
+    def __exit__(self, *exc_info):
+        if self._file is not None:
+            self._file.close()
+        elif self._writer is not None:
+            self._writer.close()
+
+
+def perform_bulk_binary_text_classification(input_file, output_file, model_dir, chunk_size, batch_size, workers):
+    started_at = time.perf_counter()
+    classified_rows = 0
+
+    with PredictionWriter(output_file) as writer:
+        for questions, predictions in classify_chunks(read_question_chunks(input_file, chunk_size), model_dir,
+                                                      batch_size, workers):
+            writer.write(questions, predictions)
+            classified_rows += len(questions)
+
+            elapsed = time.perf_counter() - started_at
+            print(f"{classified_rows} rows classified, {classified_rows / elapsed:.1f} rows/sec")
+
+    elapsed = time.perf_counter() - started_at
+    print(f"Classified {classified_rows} rows in {elapsed:.1f}s ({classified_rows / max(elapsed, 1e-9):.1f} rows/sec) "
+          f"with {workers} worker(s), written to {output_file}")
+
+
 if __name__ == "__main__":
-    seq_trained_model_dir = "output_seq_model"
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bulk", action="store_true",
+                        help="batched inference writing question,label,confidence rows to a CSV or Parquet file")
+    parser.add_argument("--input-file", default="../datasets/inference_questions.csv")
+    parser.add_argument("--output-file", help="default: ../datasets/predictions.txt, or predictions.csv with --bulk")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="questions read and written at once")
+    parser.add_argument("--batch-size", type=int, default=64, help="questions per forward pass")
+    parser.add_argument("--workers", type=int, default=1, help="processes, each with its own copy of the model")
+    args = parser.parse_args()
 
-    input_file = "../datasets/inference_questions.csv"
-    output_file = "../datasets/predictions.txt"
+    seq_trained_model_dir = "output_seq_model"
 
-    binary_classifier = load_model_and_tokenizer(seq_trained_model_dir)
-    perform_binary_text_classification(input_file, output_file, binary_classifier)
+    if args.bulk:
+        perform_bulk_binary_text_classification(args.input_file, args.output_file or "../datasets/predictions.csv",
+                                                seq_trained_model_dir, args.chunk_size, args.batch_size,
+                                                args.workers)
+    else:
+        binary_classifier = load_model_and_tokenizer(seq_trained_model_dir)
+        perform_binary_text_classification(args.input_file, args.output_file or "../datasets/predictions.txt",
+                                           binary_classifier)
@@ -1,5 +1,7 @@
 import os
+import resource
 import shutil
+import time
 
 import mlflow
 import pandas as pd
@@ -7,16 +9,31 @@ import torch
 import torch.nn.functional as F
 from datasets import Dataset
 from sklearn.metrics import precision_score, recall_score, f1_score
-from transformers import BertForSequenceClassification, BertTokenizerFast, TrainingArguments, Trainer
+from transformers import BertForSequenceClassification, BertTokenizerFast, TrainingArguments, Trainer, \
+    TrainerCallback
 import warnings
 
 warnings.filterwarnings("ignore", category=UserWarning)
 MLFLOW_BACKEND_STORE_URI = os.getenv("MLFLOW_BACKEND_STORE_URI")
+MAX_LENGTH = 128
 
 
 class CustomDataCollator:
+    """Pads each batch to its longest example only; together with group_by_length, batches hold examples of
+    similar length, so little compute is spent on padding tokens.
+
+    The same collator pads the evaluation batches, so the tokens are only counted while `count_tokens` is set, i.e.
+    during the training part of an epoch (see ThroughputCallback)."""
+
     def __init__(self, tokenizer):
         self.tokenizer = tokenizer
+        self.count_tokens = False
+        self.real_tokens = 0
+        self.padded_tokens = 0
+
+    def reset_token_counts(self):
+        self.real_tokens = 0
+        self.padded_tokens = 0
 
     def __call__(self, features):
         input_ids = [torch.tensor(item["input_ids"]) for item in features]
@@ -30,6 +47,11 @@ class CustomDataCollator:
         labels = torch.nn.utils.rnn.pad_sequence(labels, batch_first=True, padding_value=-100)
         token_type_ids = torch.nn.utils.rnn.pad_sequence(token_type_ids, batch_first=True,
                                                          padding_value=self.tokenizer.pad_token_type_id)
+
+        if self.count_tokens:
+            self.real_tokens += int(attention_mask.sum())
+            self.padded_tokens += attention_mask.numel()
+
         return {
             "input_ids": input_ids,
             "attention_mask": attention_mask,
@@ -38,6 +60,42 @@ class CustomDataCollator:
         }
 
 
+def peak_memory_mb():
+    if torch.cuda.is_available():
+        return torch.cuda.max_memory_allocated() / 1024 ** 2
+
+    # ru_maxrss is the peak resident set size of the process, in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class ThroughputCallback(TrainerCallback):
+    """Logs the training throughput, the peak memory and the share of padding tokens of each epoch to MLflow."""
+
+    def __init__(self, num_train_samples, data_collator):
+        self.num_train_samples = num_train_samples
+        self.data_collator = data_collator
+        self.epoch_started_at = None
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        self.epoch_started_at = time.perf_counter()
+        # the padding ratio is per epoch, of the training batches only
+        self.data_collator.reset_token_counts()
+        self.data_collator.count_tokens = True
+
+    def on_epoch_end(self, args, state, control, **kwargs):
+        # the evaluation of the epoch runs after this callback
+        self.data_collator.count_tokens = False
+        epoch = round(state.epoch)
+        epoch_seconds = time.perf_counter() - self.epoch_started_at
+
+        mlflow.log_metric("epoch_samples_per_second", self.num_train_samples / epoch_seconds, step=epoch)
+        mlflow.log_metric("epoch_seconds", epoch_seconds, step=epoch)
+        mlflow.log_metric("peak_memory_mb", peak_memory_mb(), step=epoch)
+        if self.data_collator.padded_tokens:
+            mlflow.log_metric("padding_ratio",
+                              1 - self.data_collator.real_tokens / self.data_collator.padded_tokens, step=epoch)
+
+
 def clean_up_directory(directory):
     if os.path.exists(directory):
         shutil.rmtree(directory)
@@ -45,8 +103,10 @@ def clean_up_directory(directory):
 
 
 def tokenize_input(example):
-    inputs = tokenizer(example['Question'], truncation=True, padding='max_length', max_length=128)
+    # no padding here, the collator pads each batch to its own longest question
+    inputs = tokenizer(example['Question'], truncation=True, max_length=MAX_LENGTH)
     inputs['labels'] = [[label] for label in example['IT_related']]
+    inputs['length'] = [len(input_ids) for input_ids in inputs['input_ids']]
 
     return inputs
 
@@ -81,7 +141,11 @@ def train_and_evaluate_model():
             learning_rate=5e-5,
             save_strategy="epoch",
             warmup_ratio=0.1,
+            group_by_length=True,  # batches of similar-length questions, see CustomDataCollator
+            length_column_name="length",
         )
+        mlflow.log_param("max_length", MAX_LENGTH)
+        mlflow.log_param("group_by_length", training_args.group_by_length)
 
         def compute_metrics(eval_pred):
             predictions, actual_classes = eval_pred.predictions, eval_pred.label_ids
@@ -123,9 +187,14 @@ def train_and_evaluate_model():
             tokenizer=tokenizer,
             data_collator=data_collator,
             compute_metrics=compute_metrics,
+            callbacks=[ThroughputCallback(len(train_dataset), data_collator)],
         )
 
-        trainer.train()
+        train_result = trainer.train()
+
+        mlflow.log_metric("train_samples_per_second", train_result.metrics["train_samples_per_second"])
+        mlflow.log_metric("train_runtime_seconds", train_result.metrics["train_runtime"])
+        mlflow.log_metric("train_peak_memory_mb", peak_memory_mb())
 
         trainer.save_model(seq_trained_model_dir)
 
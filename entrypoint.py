@@ -1,8 +1,110 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from components.api.auth_endpoints import router as auth_router
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST
+
+import components.config.constants as constants
+from components.exceptions.custom_exceptions import EmbeddingError
+from components.api.auth_endpoints import router as auth_router, password_executor
+from components.api.dependencies import token_verifier
+from components.api.health_endpoints import router as health_router
+from components.api.middleware import install_request_id_log_filter, request_context_middleware
+from components.api.model_endpoints import router as model_router
 from components.api.question_endpoints import router as question_router
+from components.qa_system.database_operations import apply_migrations, get_connection, init_connection_pool, \
+    close_connection_pool, migrate_embeddings_to_packed, backfill_question_vectors, startup_lock
+from components.qa_system.embedding_cache import query_embedding_cache
+from components.qa_system.embedding_provider import embedding_provider
+from components.qa_system.faq_index import faq_index
+from components.qa_system.faq_ingestion import sync_faq_embeddings
+from components.qa_system.faq_snapshot_publisher import faq_snapshot_publisher
+from components.qa_system.metrics import render_metrics
+from components.qa_system.model_registry import model_registry, classifier_batcher
+from components.qa_system.openai_client import openai_client
+
+logger = logging.getLogger(__name__)
+install_request_id_log_filter()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_connection_pool()
+
+    # the local embedding model is loaded once per worker, before the FAQ sync which uses it
+    await embedding_provider.start()
+    if constants.EMBEDDINGS_BACKEND == "pgvector" and embedding_provider.dimension != constants.EMBEDDING_DIMENSION:
+        raise EmbeddingError(f"The pgvector backend stores {constants.EMBEDDING_DIMENSION}-dimension vectors, "
+                             f"{embedding_provider.name} computes {embedding_provider.dimension}-dimension ones")
+
+    # the gunicorn workers start together: the first one to get the lock migrates and syncs, the others then find
+    # nothing left to convert or embed
+    with get_connection() as conn, startup_lock(conn):
+        apply_migrations(conn)
+        migrated_rows = migrate_embeddings_to_packed(conn)
+        if migrated_rows:
+            logger.info(f"Converted {migrated_rows} JSONB embeddings to packed {constants.EMBEDDING_STORAGE_FORMAT}")
+
+        if constants.EMBEDDINGS_BACKEND == "pgvector":
+            apply_migrations(conn, constants.PGVECTOR_MIGRATIONS_DIR)
+            backfill_question_vectors(conn)
+
+        if constants.FAQ_SYNC_ON_STARTUP and (constants.OPENAI_API_KEY or not embedding_provider.uses_openai):
+            synced_entries = await sync_faq_embeddings(constants.FAQ_DATABASE)
+            logger.info(f"FAQ sync finished, {synced_entries} entries (re-)embedded")
 
-app = FastAPI()
+    snapshot_publisher = None
+    if constants.EMBEDDINGS_BACKEND == "numpy":
+        if constants.FAQ_INDEX_SHARED:
+            # one of the workers publishes the FAQ snapshot, they all map it
+            snapshot_publisher = asyncio.create_task(faq_snapshot_publisher.run())
+        faq_index.reload()
+
+    token_verifier.refresh_revocations()
+    revocation_refresher = asyncio.create_task(token_verifier.run_revocation_refresher())
+    query_embedding_cache_purger = None
+    if query_embedding_cache.shared_tier:
+        query_embedding_cache_purger = asyncio.create_task(query_embedding_cache.run_purger())
+
+    try:
+        if model_registry.is_loaded:
+            # preloaded by the gunicorn master and shared copy-on-write, the inference threads are per worker though
+            model_registry.warm_up(model_registry.get_classifier())
+        elif constants.CLASSIFIER_LOAD_ON_STARTUP:
+            model_registry.load()
+    except Exception as exception:
+        # the worker still serves auth requests, /health/ready reports the classifier as not loaded
+        logger.exception(f"Error loading the classifier: {exception}")
+
+    await classifier_batcher.start()
+
+    yield
+
+    revocation_refresher.cancel()
+    if query_embedding_cache_purger is not None:
+        query_embedding_cache_purger.cancel()
+    if snapshot_publisher is not None:
+        snapshot_publisher.cancel()
+        faq_snapshot_publisher.close()
+    await classifier_batcher.stop()
+    await embedding_provider.stop()
+    await openai_client.close()
+    close_connection_pool()
+    password_executor.shutdown(wait=False)
+
+
+app = FastAPI(lifespan=lifespan)
+app.middleware("http")(request_context_middleware)
 
 app.include_router(auth_router, prefix="/auth")
 app.include_router(question_router, prefix="/questions")
+app.include_router(model_router, prefix="/models")
+app.include_router(health_router, prefix="/health")
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    # scraped by Prometheus, under gunicorn any worker returns the metrics of all of them
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)